@@ -0,0 +1,244 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import financials
+from optimizer import *
+from export import schedule_writer, shekel_payments
+from plan import MortgagePlan
+from result_cache import ResultCache
+
+PROFILE_DEFAULTS = {'is_married_couple': False, 'equal_amortization': None, 'set_prime_portion': None}
+
+
+def profiles_to_columns(profiles) -> dict:
+    # a DataFrame or a dict of equal length column arrays into numpy columns, filling the optional ones
+    if isinstance(profiles, pd.DataFrame):
+        profiles = {k: profiles[k].values for k in profiles.columns}
+    columns = {'max_first_payment_fraction': np.asarray(profiles['max_first_payment_fraction'], dtype='float64'),
+               'funding_rate': np.asarray(profiles['funding_rate'], dtype='float64')}
+    n = len(columns['funding_rate'])
+    for k, default in PROFILE_DEFAULTS.items():
+        values = np.asarray(profiles[k], dtype='object') if k in profiles else np.full(n, default, dtype='object')
+        columns[k] = np.array([default if (v is None or (isinstance(v, float) and np.isnan(v))) else v for v in values],
+                              dtype='object')
+    columns['is_married_couple'] = columns['is_married_couple'].astype('bool')
+    return columns
+
+
+def result_to_row(optimal_result: dict, net_payments: float, equal_amortization=None) -> dict:
+    # compact summary of a single result, the monthly schedules themselves are not kept
+    plan = MortgagePlan.from_result(optimal_result, net_payments, equal_amortization)
+    row = {'net_payments': net_payments, 'first_payment': plan.first_payment()}
+    for track in plan:
+        row[f'{track.amortization}_{track.rate_type}_portion'] = track.portion
+        row[f'{track.amortization}_{track.rate_type}_duration'] = track.duration
+    return row
+
+
+def result_to_payments(optimal_result: dict, net_payments: float, equal_amortization=None) -> dict:
+    # the full unit principal schedules of a single result, for export_many
+    plan = MortgagePlan.from_result(optimal_result, net_payments, equal_amortization)
+    if not len(plan):
+        raise ValueError('>>> no composition meets the first payment cap')
+    return {'net_payments': net_payments, 'payments': plan.payments()}
+
+
+def group_profiles(columns: dict) -> dict:
+    # profiles sharing a rate dictionary share the payments banks as well: their funding rates share a
+    # FUNDING_RATE_BUCKET (update_yearly_to_monthly_rates_with_risk's quantization), the exact ones otherwise
+    groups = {}
+    for i, (funding_rate, is_married_couple) in enumerate(zip(columns['funding_rate'], columns['is_married_couple'])):
+        groups.setdefault((quantize_funding_rate(funding_rate), is_married_couple), []).append(i)
+    return groups
+
+
+def init_worker(monthly_changing_yearly_madad: np.ndarray, monthly_changing_yearly_prime: np.ndarray):
+    # the rate curves are shipped once per worker process, rather than pickled again with every task
+    financials.set_rate_curves(monthly_changing_yearly_madad, monthly_changing_yearly_prime)
+
+
+def optimize_group(funding_rate: float,
+                   is_married_couple: bool,
+                   profiles: list,
+                   engine='de',
+                   de_workers=1,
+                   summarize=result_to_row,
+                   cache_path=None) -> list:
+    # funding_rate: the group's (quantized) one. profiles: [(index, max_first_payment_fraction, funding_rate,
+    # equal_amortization, set_prime_portion)], each validated (and cached) on its own funding rate.
+    # cache_path: a result_cache.ResultCache's database, opened per group (and per worker process)
+    # the group's rates are built on its first valid profile: an invalid funding rate (out of the curves' range)
+    # is that profile's error row, never the batch's
+    monthly_rates = None
+    cache = None if cache_path is None else ResultCache(cache_path)
+    rows = []
+    try:
+        for i, max_first_payment_fraction, profile_funding_rate, equal_amortization, set_prime_portion in profiles:
+            try:
+                validate_optimization_inputs(max_first_payment_fraction, profile_funding_rate)
+                if monthly_rates is None:
+                    monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
+                solve = lambda: get_optimized_principal_portions_with_amortization_defined(
+                    monthly_rates,
+                    max_first_payment_fraction,
+                    equal_amortization=equal_amortization,
+                    set_prime_portion=set_prime_portion,
+                    engine=engine,
+                    de_workers=de_workers)
+                if cache is None:
+                    optimal_result, net_payments = solve()
+                else:
+                    key = cache.key(max_first_payment_fraction, profile_funding_rate, is_married_couple,
+                                    equal_amortization, set_prime_portion, engine, de_workers)
+                    optimal_result, net_payments = cache.get_or_compute(key, solve)
+                row = summarize(optimal_result, net_payments, equal_amortization)
+            except ValueError as e:
+                row = {'net_payments': np.nan, 'first_payment': np.nan, 'error': str(e)}
+            rows.append((i, row))
+    finally:
+        if cache is not None:
+            cache.close()
+    return rows
+
+
+def profile_tasks(columns: dict,
+                  chunk_size=BATCH_CHUNK_SIZE,
+                  engine='de',
+                  de_workers=1,
+                  summarize=result_to_row,
+                  cache_path=None) -> list:
+    # optimize_group's arguments, chunks of up to chunk_size profiles of the same group
+    tasks = []
+    for (funding_rate, is_married_couple), indices in group_profiles(columns).items():
+        group = [(i,
+                  columns['max_first_payment_fraction'][i],
+                  columns['funding_rate'][i],
+                  columns['equal_amortization'][i],
+                  columns['set_prime_portion'][i]) for i in indices]
+        for j in range(0, len(group), chunk_size):
+            tasks.append((funding_rate, is_married_couple, group[j:j + chunk_size], engine, de_workers, summarize,
+                          cache_path))
+    return tasks
+
+
+def optimize_many(profiles,
+                  engine='de',
+                  workers=1,
+                  de_workers=1,
+                  chunk_size=BATCH_CHUNK_SIZE,
+                  cache_path=None) -> pd.DataFrame:
+    '''
+    profiles: DataFrame or dict of column arrays - max_first_payment_fraction, funding_rate and optionally
+    is_married_couple, equal_amortization (None for both), set_prime_portion (None for automatic).
+    workers > 1 spreads chunks of (up to chunk_size) profiles of the same group over a process pool,
+    de_workers is differential_evolution's own parallelism, for a few large jobs.
+    cache_path: a result_cache.ResultCache database serving the profiles already optimized (None: no cache).
+    returns a table of the optimal mixes (portion & duration per track), in the profiles' order.
+    '''
+    if workers != 1 and de_workers != 1:
+        raise ValueError('>>> parallelize either the profiles (workers) or the optimization (de_workers), not both')
+    columns = profiles_to_columns(profiles)
+    tasks = profile_tasks(columns, chunk_size, engine, de_workers, cache_path=cache_path)
+
+    rows = [None] * len(columns['funding_rate'])
+    if workers == 1:
+        results = map(lambda task: optimize_group(*task), tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=init_worker,
+                                       initargs=(financials.monthly_changing_yearly_MADAD,
+                                                 financials.monthly_changing_yearly_PRIME))
+        results = executor.map(optimize_group, *zip(*tasks)) if tasks else []
+    try:
+        for group_rows in results:
+            for i, row in group_rows:
+                rows[i] = row
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    df = pd.DataFrame(rows)
+    track_columns = sorted(c for c in df.columns if c.endswith('_portion') or c.endswith('_duration'))
+    other_columns = [c for c in df.columns if c not in track_columns]
+    return df[other_columns + track_columns]
+
+
+def bounded_map(executor: ProcessPoolExecutor, tasks: list, window: int):
+    # optimize_group over the tasks, in order, with up to window of them submitted (and their results held) at once
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(optimize_group, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export_many(profiles,
+                path,
+                export_format=None,
+                engine='lp',
+                workers=1,
+                de_workers=1,
+                chunk_size=BATCH_CHUNK_SIZE,
+                cache_path=None) -> dict:
+    '''
+    the month-by-month schedules of every profile streamed into a single file (csv, parquet or xlsx, see
+    export.schedule_writer): per unit principal, or in shekels given a principal column. a chunk of profiles is
+    optimized, written and dropped at a time (up to 2 chunks per worker in flight), bounding the memory whatever
+    the number of profiles. the borrower column is the profile's index, the rows come in group order.
+    cache_path: as optimize_many's.
+    returns the written rows and the profiles failing validation or infeasible (no schedules).
+    '''
+    if workers != 1 and de_workers != 1:
+        raise ValueError('>>> parallelize either the profiles (workers) or the optimization (de_workers), not both')
+    columns = profiles_to_columns(profiles)
+    principals = np.asarray(profiles['principal'], dtype='float64') if 'principal' in profiles else None
+    tasks = profile_tasks(columns, chunk_size, engine, de_workers, summarize=result_to_payments,
+                          cache_path=cache_path)
+    failed = []
+    with schedule_writer(path, export_format) as writer:
+        if workers == 1:
+            results = map(lambda task: optimize_group(*task), tasks)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           initializer=init_worker,
+                                           initargs=(financials.monthly_changing_yearly_MADAD,
+                                                     financials.monthly_changing_yearly_PRIME))
+            results = bounded_map(executor, tasks, 2 * workers)
+        try:
+            for group_rows in results:
+                for i, row in group_rows:
+                    if 'payments' not in row:
+                        failed.append(i)
+                        continue
+                    payments = row['payments'] if principals is None else shekel_payments(row['payments'], principals[i])
+                    writer.write(i, payments)
+        finally:
+            if workers != 1:
+                executor.shutdown()
+    return {'rows': writer.rows, 'failed': sorted(failed)}
+
+
+if __name__ == '__main__':
+    from time import time
+
+    rng = np.random.default_rng(SEED)
+    n = 200
+    profiles = {'max_first_payment_fraction': rng.uniform(1 / 250, 1 / 70, n),
+                'funding_rate': rng.choice([0.5, 0.6, 0.7, 0.75], n),
+                'is_married_couple': rng.integers(2, size=n).astype('bool'),
+                'equal_amortization': rng.choice([False, True, None], n),
+                'set_prime_portion': rng.choice([None, 1 / 3], n)}
+    tic = time()
+    df = optimize_many(profiles, engine='lp')
+    print(df)
+    print(f'{n} profiles in {time() - tic:.2f}s')
+
+    tic = time()
+    parallel_df = optimize_many(profiles, engine='lp', workers=4)
+    print(f'{n} profiles in {time() - tic:.2f}s over 4 processes, same results: {parallel_df.equals(df)}')
+
+    tic = time()
+    exported = export_many(dict(profiles, principal=rng.uniform(500000, 2000000, n)), 'schedules.csv', engine='lp')
+    print(f"{exported['rows']} schedule rows of {n} profiles exported in {time() - tic:.2f}s")
@@ -0,0 +1,392 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import financials
+import numpy_financial_functions as npff
+from optimizer import *
+from htmling import beutify_HTML, render_HTML
+from export import report_payments
+from scenarios import generate_rate_scenarios, scenario_totals, stress_test
+
+# representative borrower: 2,150,000 asset, 950,000 capital, 6,718 max monthly payment
+MAX_FIRST_PAYMENT_FRACTION = 6718 / 1200000
+FUNDING_RATE = 1200000 / 2150000
+PRINCIPAL_PORTIONS = {'fixed': 0.5, 'madad': 0.25, 'prime': 0.25}
+COMPOSITION_DURATIONS = {'fixed': 240, 'madad': 180, 'prime': 240}
+
+# (asset_cost, capital, max_monthly_payment, is_married_couple)
+BORROWERS = {'representative': (2150000, 950000, 6718, False),
+             'tight cap': (1800000, 600000, 5200, True),
+             'high funding': (2400000, 600000, 12000, False)}
+AMORTIZATION_MODES = {'spitzer': False, 'equal': True, 'joint': None}
+PRIME_MODES = {'auto prime': None, 'third prime': 1 / 3, 'two thirds prime': 2 / 3}
+# 2 / 3 prime leaves madad no room (MAX_UNFIXED_PORTON - 2 / 3 < MIN_UNFIXED_PORTON): lp answers infeasible,
+# while differential_evolution raises on the inverted madad bounds, as it always did. lp only for it then
+DE_EXCLUDED_PRIME_MODES = ['two thirds prime']
+HTML_RENDERERS = {'beutify_HTML': beutify_HTML, 'render_HTML': render_HTML}
+BATCH_REPORTS = 50
+# the browser bundle's imports: pyscript-lite.json's numpy alone, against the former numpy, scipy & pandas one
+STARTUP_IMPORTS = {'lite': 'import financials, optimizer, session, htmling',
+                   'full': 'import scipy.optimize, scipy.interpolate, pandas, financials, optimizer, session, htmling'}
+
+
+def timeit(func, repeat=20) -> float:
+    # best of repeat, in seconds
+    times = []
+    for _ in range(repeat):
+        tic = perf_counter()
+        func()
+        times.append(perf_counter() - tic)
+    return min(times)
+
+
+def measure(name: str, func, repeat=20) -> dict:
+    # best of repeat time and the peak traced (python & numpy) memory of a single call
+    seconds = timeit(func, repeat)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'benchmark': name, 'ms': 1e3 * seconds, 'peak KiB': peak / 2 ** 10}
+
+
+def borrower_inputs(asset_cost: int, capital: int, max_monthly_payment: int) -> (float, float):
+    principal = asset_cost - capital
+    return max_monthly_payment / principal, principal / asset_cost
+
+
+def bench_financial_functions(seed=SEED) -> list:
+    rng = np.random.default_rng(seed)
+    rate = rng.uniform(0.02, 0.06, MAX_DURATION) / 12
+    per = np.arange(MAX_DURATION) + 1
+    return [measure('npff.pmt', lambda: npff.pmt(rate, MAX_DURATION, 1.)),
+            measure('npff.ipmt', lambda: npff.ipmt(rate, per, MAX_DURATION, 1.)),
+            measure('npff.ppmt', lambda: npff.ppmt(rate, per, MAX_DURATION, 1.)),
+            measure('npff.fv', lambda: npff.fv(rate, per, -0.005, 1.))]
+
+
+def bench_amortizations() -> list:
+    monthly_rates = update_yearly_to_monthly_rates_with_risk(FUNDING_RATE)
+    rows = []
+    for schedule in AMORTIZATION_SCHEDULES:
+        rows += [measure(f'get_spitzer_amortization {schedule}',
+                         lambda: get_spitzer_amortization(monthly_rates['prime_rate'], MAX_DURATION, 1., schedule=schedule)),
+                 measure(f'get_equal_amortization {schedule}',
+                         lambda: get_equal_amortization(monthly_rates['prime_rate'], MAX_DURATION, 1., schedule=schedule))]
+    rows.append(measure('PaymentsBank build', lambda: PaymentsBank(monthly_rates)))
+    return rows
+
+
+def bench_compositions() -> list:
+    payments_bank = PaymentsBank(update_yearly_to_monthly_rates_with_risk(FUNDING_RATE))
+    return [measure(f'get_optimized_composition {engine}',
+                    lambda: get_optimized_composition(None, PRINCIPAL_PORTIONS, MAX_FIRST_PAYMENT_FRACTION,
+                                                      payments_bank=payments_bank, engine=engine),
+                    repeat=5 if engine == 'loop' else 200)
+            for engine in COMPOSITION_ENGINES]
+
+
+def bench_optimize(engines=('de', 'lp')) -> list:
+    # every amortization & prime mode of every borrower, on warm rate & payments bank caches
+    rows = []
+    for borrower, (asset_cost, capital, max_monthly_payment, is_married_couple) in BORROWERS.items():
+        max_first_payment_fraction, funding_rate = borrower_inputs(asset_cost, capital, max_monthly_payment)
+        for mode, equal_amortization in AMORTIZATION_MODES.items():
+            for prime_mode, set_prime_portion in PRIME_MODES.items():
+                for engine in engines:
+                    if engine == 'de' and prime_mode in DE_EXCLUDED_PRIME_MODES:
+                        continue
+                    rows.append(measure(f'optimize {engine} {borrower} {mode} {prime_mode}',
+                                        lambda: optimize(max_first_payment_fraction,
+                                                         funding_rate,
+                                                         is_married_couple=is_married_couple,
+                                                         equal_amortization=equal_amortization,
+                                                         set_prime_portion=set_prime_portion,
+                                                         engine=engine),
+                                        repeat=2 if engine == 'de' else 10))
+    return rows
+
+
+def bench_scenarios() -> list:
+    # SCENARIO_COUNT rate paths: their totals & first payments, stress tests of the fixed portions & of the grid
+    scenarios = generate_rate_scenarios()
+    stress = lambda principal_portions, objective: stress_test(MAX_FIRST_PAYMENT_FRACTION,
+                                                               FUNDING_RATE,
+                                                               principal_portions=principal_portions,
+                                                               objective=objective,
+                                                               scenarios=scenarios)
+    return [measure(f'scenario totals {SCENARIO_COUNT}', lambda: scenario_totals(scenarios, FUNDING_RATE), repeat=3),
+            measure(f'stress test {SCENARIO_COUNT} fixed portions p95', lambda: stress(PRINCIPAL_PORTIONS, 'p95'),
+                    repeat=3),
+            measure(f'stress test {SCENARIO_COUNT} grid mean', lambda: stress(None, 'mean'), repeat=3),
+            measure(f'stress test {SCENARIO_COUNT} grid p95', lambda: stress(None, 'p95'), repeat=1)]
+
+
+def borrower_report(asset_cost: int, capital: int, max_monthly_payment: int, is_married_couple: bool,
+                    mode='spitzer', set_prime_portion=None) -> tuple:
+    # the renderers' arguments of the borrower's lp optimum
+    equal_amortization = AMORTIZATION_MODES[mode]
+    optimal_result, _ = optimize(*borrower_inputs(asset_cost, capital, max_monthly_payment),
+                                 is_married_couple=is_married_couple,
+                                 equal_amortization=equal_amortization,
+                                 set_prime_portion=set_prime_portion,
+                                 engine='lp')
+    total_monthly_payments = report_payments(optimal_result, equal_amortization, asset_cost - capital)
+    amortizations = ['equal', 'spitzer'] if equal_amortization is None else [mode]
+    prime = 0 if set_prime_portion is None else 1
+    return (total_monthly_payments, asset_cost, capital, max_monthly_payment, 20154, is_married_couple, True,
+            amortizations, prime)
+
+
+def batch_reports(n=BATCH_REPORTS, seed=SEED) -> list:
+    rng = np.random.default_rng(seed)
+    reports = []
+    while len(reports) < n:
+        asset_cost = int(rng.integers(1000000, 4000000))
+        capital = int(asset_cost * rng.uniform(0.3, 0.6))
+        max_monthly_payment = int((asset_cost - capital) * rng.uniform(1 / 200, 1 / 90))
+        try:
+            report = borrower_report(asset_cost, capital, max_monthly_payment, bool(rng.integers(2)),
+                                     mode=list(AMORTIZATION_MODES)[rng.integers(len(AMORTIZATION_MODES))],
+                                     set_prime_portion=[None, 1 / 3][rng.integers(2)])
+        except ValueError:
+            continue
+        if len(report[0]) > 1:  # a feasible cap
+            reports.append(report)
+    return reports
+
+
+def bench_html() -> list:
+    # the report of every amortization mode and a batch of random borrowers' ones, by every renderer. render_HTML
+    # must reproduce beutify_HTML's markup
+    reports = {mode: borrower_report(*BORROWERS['representative'], mode=mode) for mode in AMORTIZATION_MODES}
+    batch = batch_reports()
+    for report in list(reports.values()) + batch:
+        if render_HTML(*report) != beutify_HTML(*report):
+            raise AssertionError('>>> render_HTML differs from beutify_HTML')
+    rows = []
+    for name, renderer in HTML_RENDERERS.items():
+        rows += [measure(f'{name} {mode}', lambda: renderer(*report)) for mode, report in reports.items()]
+        rows.append(measure(f'{name} batch of {len(batch)}', lambda: [renderer(*report) for report in batch], repeat=5))
+    return rows
+
+
+def startup(statement: str, trace_memory=False) -> float:
+    # seconds (or traced peak bytes) of the statement's imports, in a fresh interpreter
+    code = ('import tracemalloc; tracemalloc.start(); ' if trace_memory else '') + \
+           f'from time import perf_counter; tic = perf_counter(); {statement}; ' + \
+           ('print(tracemalloc.get_traced_memory()[1])' if trace_memory else 'print(perf_counter() - tic)')
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(completed.stdout)
+
+
+def bench_startup(repeat=5) -> list:
+    # a proxy of the page's cold start: pyodide downloads & unpacks the packages too, which the local imports lack
+    return [{'benchmark': f'startup {profile}',
+             'ms': 1e3 * min(startup(statement) for _ in range(repeat)),
+             'peak KiB': startup(statement, trace_memory=True) / 2 ** 10}
+            for profile, statement in STARTUP_IMPORTS.items()]
+
+
+# the joint (both amortizations) path on finer duration grids: DURATION_STEP months, each in a fresh interpreter
+FINE_GRID_STEPS = (60, 12, 1)
+FINE_GRID_TIMEOUT = 600  # seconds per grid, beyond which its timing is reported as inf
+FINE_GRID_CODE = """
+import json, tracemalloc
+from time import perf_counter
+import params
+params.DURATION_STEP = {step}
+params.DURATIONS = list(range(params.MIN_DURATION, params.MAX_DURATION + 1, {step}))
+from optimizer import *
+
+monthly_rates = update_yearly_to_monthly_rates_with_risk({funding_rate})
+banks = {{'equal': get_payments_bank(monthly_rates, True), 'spitzer': get_payments_bank(monthly_rates, False)}}
+totals = np.array([banks[a].totals[r] for a, r in JOINT_TRACKS])
+first_payments = np.array([banks[a].first_payments[r] for a, r in JOINT_TRACKS], dtype='float64')
+target_function = JointTargetFunction(totals, first_payments, {max_first_payment_fraction})
+bounds = principal_portions_bounds()
+rng = np.random.default_rng(SEED)
+xs = np.column_stack([rng.uniform(*bounds['madad'], {calls}), rng.uniform(*bounds['prime'], {calls}),
+                      rng.uniform(0, 1, ({calls}, 3))])
+tic = perf_counter()
+for x in xs:
+    target_function(x)
+objective_seconds = (perf_counter() - tic) / len(xs)
+tracemalloc.start()
+target_function(xs[0])
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+tic = perf_counter()
+optimize({max_first_payment_fraction}, {funding_rate}, equal_amortization=None, engine='de')
+print(json.dumps([objective_seconds, peak, perf_counter() - tic]))
+"""
+
+
+def bench_fine_grid(steps=FINE_GRID_STEPS, max_first_payment_fraction=1 / 150, funding_rate=0.7, calls=50) -> list:
+    # ms & peak memory of a joint objective call, and the seconds of a joint de optimize(), per duration grid
+    rows = []
+    for step in steps:
+        code = FINE_GRID_CODE.format(step=step, funding_rate=funding_rate,
+                                     max_first_payment_fraction=max_first_payment_fraction, calls=calls)
+        try:
+            completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                       timeout=FINE_GRID_TIMEOUT, cwd=os.path.dirname(os.path.abspath(__file__)))
+            objective_seconds, peak, optimize_seconds = json.loads(completed.stdout.splitlines()[-1])
+        except subprocess.TimeoutExpired:
+            objective_seconds, peak, optimize_seconds = np.inf, np.nan, np.inf
+        rows += [{'benchmark': f'joint objective step {step}', 'ms': 1e3 * objective_seconds, 'peak KiB': peak / 2 ** 10},
+                 {'benchmark': f'joint optimize de step {step}', 'ms': 1e3 * optimize_seconds, 'peak KiB': np.nan}]
+    return rows
+
+
+# the milp's optimum against the differential evolution's on random profiles: with a zero gap it is never worse
+CROSSCHECK_PROFILES = 100
+
+
+def crosscheck_milp(n=CROSSCHECK_PROFILES, seed=SEED) -> list:
+    # de & lp net payments per profile, de's relative excess over the lp optimum (nan: both infeasible)
+    rng = np.random.default_rng(seed)
+    rows = []
+    for k in range(n):
+        profile = {'max_first_payment_fraction': rng.uniform(1 / 250, 1 / 70),
+                   'funding_rate': float(rng.choice([0.5, 0.6, 0.7, 0.75])),
+                   'is_married_couple': bool(rng.integers(2)),
+                   'equal_amortization': [False, True, None][rng.integers(3)],
+                   'set_prime_portion': [None, 1 / 3][rng.integers(2)]}
+        de = optimize(**profile, engine='de')[1]
+        lp = optimize(**profile, engine='lp')[1]
+        rows.append({'profile': k,
+                     'de': de,
+                     'lp': lp,
+                     'de excess': np.nan if np.isinf(lp) else de / lp - 1,
+                     'lp worse': 'yes' if lp > de * (1 + 1e-9) else ''})
+    return rows
+
+
+def composition_net_payments(payments_bank: PaymentsBank) -> float:
+    schedules = materialize_composition(payments_bank, PRINCIPAL_PORTIONS, COMPOSITION_DURATIONS)
+    return sum(float(track[d]['pmt'].astype('float64').sum()) for track in schedules.values() for d in track)
+
+
+def bench_dtype(policies=(('float16', None), ('float64', None), ('float64', 'float32'))) -> list:
+    # speed, memory and net_payments accuracy of the dtype policies, against the float64 one
+    rows = []
+    for compute_dtype, storage_dtype in policies:
+        financials.set_dtype_policy(compute_dtype, storage_dtype)
+        monthly_rates = update_yearly_to_monthly_rates_with_risk(FUNDING_RATE)
+        build = timeit(lambda: PaymentsBank(monthly_rates, storage_dtype=storage_dtype))
+        payments_bank = PaymentsBank(monthly_rates, storage_dtype=storage_dtype)
+        composition = timeit(lambda: get_optimized_composition(None, PRINCIPAL_PORTIONS, MAX_FIRST_PAYMENT_FRACTION,
+                                                               payments_bank=payments_bank), repeat=200)
+        rows.append({'policy': f'{compute_dtype}/{storage_dtype or compute_dtype}',
+                     'bank build ms': 1e3 * build,
+                     'composition us': 1e6 * composition,
+                     'bank KiB': payments_bank.nbytes() / 2 ** 10,
+                     'net_payments': composition_net_payments(payments_bank)})
+    financials.set_dtype_policy()
+    reference = PaymentsBank(update_yearly_to_monthly_rates_with_risk(FUNDING_RATE))
+    reference_net_payments = composition_net_payments(reference)
+    for row in rows:
+        row['net_payments rel. error'] = abs(row['net_payments'] / reference_net_payments - 1)
+    return rows
+
+
+BENCHMARKS = {'financial_functions': bench_financial_functions,
+              'amortizations': bench_amortizations,
+              'compositions': bench_compositions,
+              'optimize': bench_optimize,
+              'html': bench_html,
+              'scenarios': bench_scenarios,
+              'startup': bench_startup,
+              'fine_grid': bench_fine_grid}
+# the minutes long fine grid check runs when asked for only
+DEFAULT_BENCHMARKS = [name for name in BENCHMARKS if name != 'fine_grid']
+
+
+def run_benchmarks(names=tuple(DEFAULT_BENCHMARKS)) -> list:
+    rows = []
+    for name in names:
+        rows += BENCHMARKS[name]()
+    return rows
+
+
+def environment() -> dict:
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'durations': len(DURATIONS),
+            'dtype policy': dict(financials.DTYPE_POLICY)}
+
+
+def save_baseline(rows: list, path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'benchmarks': rows}, f, indent=2)
+
+
+def compare_to_baseline(rows: list, path: str, tolerance=BENCHMARK_TOLERANCE) -> list:
+    # the rows with their time ratio to the baseline, regressed beyond 1 + tolerance
+    with open(path, encoding='utf-8') as f:
+        baseline = {row['benchmark']: row for row in json.load(f)['benchmarks']}
+    compared = []
+    for row in rows:
+        if row['benchmark'] not in baseline:
+            continue
+        ratio = row['ms'] / baseline[row['benchmark']]['ms']
+        compared.append({'benchmark': row['benchmark'],
+                         'baseline ms': baseline[row['benchmark']]['ms'],
+                         'ms': row['ms'],
+                         'ratio': ratio,
+                         'regressed': 'yes' if ratio > 1 + tolerance else ''})
+    return compared
+
+
+def print_table(rows: list):
+    columns = list(rows[0].keys())
+    print(' | '.join(f'{c:>24}' for c in columns))
+    for row in rows:
+        print(' | '.join(f'{row[c]:>24.6g}' if isinstance(row[c], float) else f'{row[c]:>24}' for c in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='mortgager benchmarks')
+    choices = list(BENCHMARKS) + ['dtype', 'crosscheck']
+    # checked below: argparse (3.11 at least) checks a bare nargs='*' empty list against choices, as a whole
+    parser.add_argument('benchmarks', nargs='*', default=None, metavar='benchmark',
+                        help=f'any of {", ".join(choices)} (default: {" ".join(DEFAULT_BENCHMARKS)})')
+    parser.add_argument('--save', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', help='compare the results to a JSON baseline, failing on regressions')
+    parser.add_argument('--tolerance', type=float, default=BENCHMARK_TOLERANCE)
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(DEFAULT_BENCHMARKS)
+    unknown = [name for name in names if name not in choices]
+    if unknown:
+        parser.error(f'invalid benchmarks: {", ".join(unknown)} (choose from {", ".join(choices)})')
+    if 'dtype' in names:
+        print_table(bench_dtype())
+        names.remove('dtype')
+    if 'crosscheck' in names:
+        crosscheck = crosscheck_milp()
+        print_table(crosscheck)
+        if any(row['lp worse'] for row in crosscheck):
+            sys.exit(1)
+        names.remove('crosscheck')
+    if not names:
+        sys.exit()
+    rows = run_benchmarks(names)
+    print_table(rows)
+    if args.save:
+        save_baseline(rows, args.save)
+    if args.compare:
+        compared = compare_to_baseline(rows, args.compare, args.tolerance)
+        if compared:
+            print_table(compared)
+        if any(row['regressed'] for row in compared):
+            sys.exit(1)
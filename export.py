@@ -0,0 +1,187 @@
+import io
+import numpy as np
+from plan import PAYMENTS, MortgagePlan
+from params import *
+
+SCHEDULE_COLUMNS = ['borrower', 'track', 'month'] + PAYMENTS
+
+
+def report_payments(optimal_result: dict, equal_amortization=None, principal=None) -> dict:
+    # {track: {'pmt', 'ipmt', 'ppmt', 'indexation'}} and their 'total', as main.func reports them: per unit
+    # principal, or in (ceiled int32) shekels of a principal
+    return MortgagePlan.from_result(optimal_result, equal_amortization=equal_amortization).payments(principal)
+
+
+def shekel_payments(payments: dict, principal: float) -> dict:
+    return {k: {p: np.ceil(v[p] * principal).astype('int32') for p in PAYMENTS} for k, v in payments.items()}
+
+
+class ScheduleWriter:
+    '''
+    streams borrowers' month-by-month schedules (total_monthly_payments: {track: {'pmt', 'ipmt', 'ppmt',
+    'indexation'}}, 'total' included) into a single file, a row per (borrower, track, month). every track is
+    written as a single block of its arrays and nothing is kept beyond the writer's own buffer, whatever the
+    number of borrowers.
+    with ScheduleWriter(path) as writer: writer.write(borrower, total_monthly_payments) ...
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+
+    def write(self, borrower, total_monthly_payments: dict):
+        for track, schedule in total_monthly_payments.items():
+            months = np.arange(1, len(schedule['pmt']) + 1)
+            self.write_block(str(borrower), track, months, [schedule[p] for p in PAYMENTS])
+            self.rows += len(months)
+
+    def write_block(self, borrower: str, track: str, months: np.ndarray, payments: list):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvScheduleWriter(ScheduleWriter):
+    # path: a file path or an open text file (e.g. io.StringIO, kept open)
+    def __init__(self, path):
+        super().__init__(path)
+        self.owned = not hasattr(path, 'write')
+        self.file = open(path, 'w', encoding='utf-8', newline='') if self.owned else path
+        self.file.write(','.join(SCHEDULE_COLUMNS) + '\n')
+
+    @staticmethod
+    def field(text: str) -> str:
+        # csv quoting
+        if any(c in text for c in ',"\n'):
+            text = '"' + text.replace('"', '""') + '"'
+        return text
+
+    def write_block(self, borrower, track, months, payments):
+        # savetxt formats the numbers alone (its fmt counts every '%'), the labels prefix its lines
+        value = '%d' if np.issubdtype(payments[0].dtype, np.integer) else '%.10g'
+        rows = io.StringIO()
+        np.savetxt(rows, np.column_stack([months] + payments), fmt=','.join(['%d'] + [value] * len(payments)))
+        prefix = f'{self.field(borrower)},{self.field(track)},'
+        self.file.writelines(prefix + line for line in rows.getvalue().splitlines(keepends=True))
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+
+class ParquetScheduleWriter(ScheduleWriter):
+    # optional dependency: pyarrow. rows are buffered up to PARQUET_ROW_GROUP_SIZE, a row group per flush
+    def __init__(self, path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ModuleNotFoundError:
+            raise ImportError('>>> parquet export requires pyarrow (pip install pyarrow)')
+        super().__init__(path)
+        self.pa, self.pq = pa, pq
+        self.row_group_size = row_group_size
+        self.blocks = []
+        self.buffered = 0
+        self.writer = None
+
+    def write_block(self, borrower, track, months, payments):
+        self.blocks.append((borrower, track, months, payments))
+        self.buffered += len(months)
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.blocks:
+            return
+        pa = self.pa
+        lengths = [len(months) for _, _, months, _ in self.blocks]
+        columns = {'borrower': pa.array(np.repeat([b for b, _, _, _ in self.blocks], lengths)),
+                   'track': pa.array(np.repeat([t for _, t, _, _ in self.blocks], lengths)),
+                   'month': pa.array(np.concatenate([months for _, _, months, _ in self.blocks]).astype('int16'))}
+        for k, p in enumerate(PAYMENTS):
+            columns[p] = pa.array(np.concatenate([payments[k] for _, _, _, payments in self.blocks]))
+        table = pa.table(columns)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.blocks = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class XlsxScheduleWriter(ScheduleWriter):
+    # optional dependency: openpyxl, in its write only (streaming) mode. sheets roll over at XLSX_MAX_ROWS
+    def __init__(self, path, max_rows=XLSX_MAX_ROWS):
+        try:
+            from openpyxl import Workbook
+        except ModuleNotFoundError:
+            raise ImportError('>>> xlsx export requires openpyxl (pip install openpyxl)')
+        super().__init__(path)
+        self.workbook = Workbook(write_only=True)
+        self.max_rows = max_rows
+        self.sheet, self.sheet_rows = None, max_rows
+
+    def write_block(self, borrower, track, months, payments):
+        rows = zip(months.tolist(), *[p.tolist() for p in payments])
+        for row in rows:
+            if self.sheet_rows >= self.max_rows:
+                self.sheet = self.workbook.create_sheet(f'schedules {len(self.workbook.worksheets) + 1}')
+                self.sheet.append(SCHEDULE_COLUMNS)
+                self.sheet_rows = 1
+            self.sheet.append([borrower, track, *row])
+            self.sheet_rows += 1
+
+    def close(self):
+        if self.sheet is None:  # an empty workbook still gets its header
+            self.workbook.create_sheet('schedules 1').append(SCHEDULE_COLUMNS)
+        self.workbook.save(self.path)
+
+
+EXPORT_FORMATS = {'csv': CsvScheduleWriter, 'parquet': ParquetScheduleWriter, 'xlsx': XlsxScheduleWriter}
+
+
+def schedule_writer(path, export_format=None) -> ScheduleWriter:
+    # the format defaults to the path's extension
+    if export_format is None:
+        export_format = str(path).rsplit('.', 1)[-1].lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'>>> export_format must be one of {list(EXPORT_FORMATS)}, got {export_format}')
+    return EXPORT_FORMATS[export_format](path)
+
+
+def schedules_csv(total_monthly_payments: dict, borrower='') -> str:
+    # a single borrower's full schedules as csv text (the report's download link)
+    from io import StringIO
+    text = StringIO()
+    with CsvScheduleWriter(text) as writer:
+        writer.write(borrower, total_monthly_payments)
+    return text.getvalue()
+
+
+if __name__ == '__main__':
+    from time import time
+    from optimizer import optimize
+
+    principal, asset_cost = 1200000, 2150000
+    optimal_result, _ = optimize(6718 / principal, principal / asset_cost, equal_amortization=None, engine='lp')
+    total_monthly_payments = report_payments(optimal_result, None, principal)
+    for export_format in EXPORT_FORMATS:
+        tic = time()
+        try:
+            with schedule_writer(f'schedules.{export_format}') as writer:
+                for borrower in range(1000):
+                    writer.write(borrower, total_monthly_payments)
+        except ImportError as e:
+            print(e)
+            continue
+        print(f'{export_format}: {writer.rows} rows in {time() - tic:.2f}s')
@@ -1,19 +1,24 @@
+from functools import lru_cache
+import itertools
 import numpy as np
-from scipy.interpolate import interp1d
 import numpy_financial_functions as npff
+from rate_provider import OfflineRateProvider
 from params import *
 
+DTYPE_POLICY = {'compute': COMPUTE_DTYPE,  # the rate curves, rates and schedules
+                'storage': BANK_STORAGE_DTYPE}  # the optimizer's payments banks, None for the compute dtype
+
 
 def get_madad(initial_value=MADAD_INITIAL_VALUE,
               initial_steady_period_months_duration=INITIAL_STEADY_PERIOD_MONTHS_DURATION,
               steady_ramp_months_duration=STEADY_RAMP_MONTHS_DURATION,
               long_range_centerline=LONG_RANGE_CENTERLINE):
 
-    madad_0 = initial_value * np.ones(initial_steady_period_months_duration, dtype='float16')
+    madad_0 = initial_value * np.ones(initial_steady_period_months_duration, dtype=DTYPE_POLICY['compute'])
     madad_1 = np.polyval([(long_range_centerline - initial_value) / steady_ramp_months_duration, madad_0[-1]],
                          np.arange(steady_ramp_months_duration))
     madad_2 = madad_1[-1] * np.ones(MAX_DURATION)
-    madad = np.concatenate([madad_0, madad_1, madad_2]).astype('float16')
+    madad = np.concatenate([madad_0, madad_1, madad_2]).astype(DTYPE_POLICY['compute'], copy=False)
     return madad
 
 
@@ -24,20 +29,85 @@ def get_prime(initial_value=PRIME_INITIAL_VALUE,
               banks_margine=BANKS_MARGINE,
               wavewlwngthy=10,
               amplitude=0.015):
-    try:
-        initial_value = requests.get('https://Boi.org.il/PublicApi/GetInterest').json()['currentInterest'] / 100
-    except:
-        pass
-    prime_0 = initial_value * np.ones(initial_steady_period_months_duration, dtype='float16') + banks_margine
+    prime_0 = initial_value * np.ones(initial_steady_period_months_duration, dtype=DTYPE_POLICY['compute']) + banks_margine
     prime_1 = np.polyval([(long_range_centerline - prime_0[-1]) / steady_ramp_months_duration, prime_0[-1]],
                          np.arange(steady_ramp_months_duration))
     prime_2 = np.sin(2 * np.pi * np.arange(0, 30, 1 / 12) / wavewlwngthy) * amplitude + prime_1[-1]
-    prime = np.concatenate([prime_0, prime_1, prime_2]).astype('float16')
+    prime = np.concatenate([prime_0, prime_1, prime_2]).astype(DTYPE_POLICY['compute'], copy=False)
     return prime
 
 
-monthly_changing_yearly_MADAD = get_madad()
-monthly_changing_yearly_PRIME = get_prime()
+# the madad & prime curves are built lazily, from the rate provider's (by default the bundled snapshot) interest rate
+rate_provider = OfflineRateProvider()
+_rate_curves = {}
+_curves_generations = itertools.count(1)  # numbers every built or set curves, keying what is derived from them
+
+
+def get_rate_curves() -> dict:
+    # rebuilt whenever the provider's rate differs from the one they were built from (a refresh, or a fetched
+    # rate's ttl expiring back to the fallback's). set_rate_curves' curves (interest_rate None) are kept as set.
+    # 'generation' differs between any two curves built or set
+    if _rate_curves and _rate_curves['interest_rate'] is None:
+        return _rate_curves
+    interest_rate = rate_provider.get_interest_rate()
+    if not _rate_curves or _rate_curves['interest_rate'] != interest_rate:
+        rebuild_rate_curves()
+        _rate_curves.update(madad=get_madad(), prime=get_prime(initial_value=interest_rate), interest_rate=interest_rate,
+                            generation=next(_curves_generations))
+    return _rate_curves
+
+
+def __getattr__(name):
+    if name == 'monthly_changing_yearly_MADAD':
+        return get_rate_curves()['madad']
+    if name == 'monthly_changing_yearly_PRIME':
+        return get_rate_curves()['prime']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def as_compute_dtype(arrays: dict) -> dict:
+    return {k: np.asarray(v, dtype=DTYPE_POLICY['compute']) for k, v in arrays.items()}
+
+
+def rebuild_rate_curves():
+    _rate_curves.clear()
+    rates_cache_clear()
+
+
+def set_rate_curves(monthly_changing_yearly_madad: np.ndarray, monthly_changing_yearly_prime: np.ndarray):
+    _rate_curves.update(madad=monthly_changing_yearly_madad, prime=monthly_changing_yearly_prime, interest_rate=None,
+                        generation=next(_curves_generations))
+    rates_cache_clear()
+
+
+def set_rate_provider(provider):
+    global rate_provider
+    rate_provider = provider
+    rebuild_rate_curves()
+
+
+def refresh_rate_curves() -> bool:
+    # blocking (timeout bounded) refresh of the provider's rate, rebuilding the curves if it changed
+    if rate_provider.refresh():
+        rebuild_rate_curves()
+        return True
+    return False
+
+
+async def refresh_rate_curves_async() -> bool:
+    if await rate_provider.refresh_async():
+        rebuild_rate_curves()
+        return True
+    return False
+
+
+def set_dtype_policy(compute_dtype=COMPUTE_DTYPE, storage_dtype=BANK_STORAGE_DTYPE):
+    # float64 computing by default, float32 storage saves half the memory of large (batch) payments banks.
+    # the rate curves are rebuilt in the new compute dtype
+    DTYPE_POLICY['compute'] = compute_dtype
+    DTYPE_POLICY['storage'] = storage_dtype
+    rebuild_rate_curves()
+
 
 def yearly_rate_to_monthly(yearly_rate) -> np.ndarray:
     return yearly_rate / 12
@@ -45,24 +115,185 @@ def yearly_rate_to_monthly(yearly_rate) -> np.ndarray:
 def nominal_interest_rate_to_effective(yearly_rate: np.ndarray) -> np.ndarray:
     return (1 + yearly_rate_to_monthly(yearly_rate)) ** 12 - 1
 
-def get_spitzer_amortization(monthly_rate_array: np.ndarray, duration: int, principal: int) -> dict:
+def get_spitzer_amortization(monthly_rate_array: np.ndarray, duration: int, principal: int,
+                             schedule=AMORTIZATION_SCHEDULE) -> dict:
+    if schedule != 'flat':
+        return {p: v[0] for p, v in amortization_tensors(monthly_rate_array, [duration], principal,
+                                                        schedule=schedule).items() if p != 'mask'}
     per = np.arange(duration) + 1 # periods (months)
     ipmt = - npff.ipmt(monthly_rate_array[:duration], per, duration, principal) # interest portion of a payment
     ppmt = (principal / duration) * np.ones_like(per)  # payment against loan principal
     pmt = ((ipmt.sum() + principal) / duration) * np.ones_like(per) # monthly payment against loan principal plus interest
-    return {'pmt': pmt.astype('float16'), 'ipmt': ipmt.astype('float16'), 'ppmt': ppmt.astype('float16')}
+    return as_compute_dtype({'pmt': pmt, 'ipmt': ipmt, 'ppmt': ppmt})
 
-def get_equal_amortization(monthly_rate_array, duration, principal) -> dict:
+def get_equal_amortization(monthly_rate_array, duration, principal, schedule=AMORTIZATION_SCHEDULE) -> dict:
+    if schedule != 'flat':
+        return {p: v[0] for p, v in amortization_tensors(monthly_rate_array, [duration], principal,
+                                                        equal_amortization=True, schedule=schedule).items() if p != 'mask'}
     per = np.arange(duration) + 1 # periods (months)
     ppmt = principal / duration * np.ones_like(per) # payment against loan principal
     ipmt = (principal - ppmt.cumsum()) * monthly_rate_array[:duration] # interest portion of a payment
     pmt = ipmt + ppmt # monthly payment against loan principal plus interest
-    return {'pmt': pmt.astype('float16'), 'ipmt': ipmt.astype('float16'), 'ppmt': ppmt.astype('float16')}
+    return as_compute_dtype({'pmt': pmt, 'ipmt': ipmt, 'ppmt': ppmt})
 
-fixed_yearly_risk_rate = lambda r: interp1d([0., .45, .6, .7, .75],
-                                            [.028, .0285, .03, .0315, .0315], kind='cubic')(r)
-madad_added_risk_yearly_rate = lambda r: interp1d([0., .45, .6, .7, .75],
-                                                  [.018, .019, .0205, .0225, .0225], kind='cubic')(r)
+def amortization_tensors(monthly_rates: np.ndarray,
+                         durations,
+                         principal=1.,
+                         equal_amortization=False,
+                         schedule=AMORTIZATION_SCHEDULE,
+                         monthly_inflation=None) -> dict:
+    '''
+    batched get_spitzer_amortization / get_equal_amortization: monthly rates of shape (..., months) and a vector
+    of durations into (..., len(durations), max(durations)) pmt / ipmt / ppmt tensors, in one call.
+    the tensors are zero padded beyond each duration, where mask (len(durations), max(durations)) is False.
+    schedule='recursive' amortizes the remaining balance under the time varying rate: spitzer re-annuitizes it
+    every month over the remaining periods, equal principal pays interest on the balance before the payment.
+    schedule='flat' is the former approximation: flat payment & principal, interest on npff.ipmt's closed form.
+    monthly_inflation (broadcastable to monthly_rates) indexes the outstanding principal (CPI linked loans):
+    monthly_rates are then the real rates, ppmt stays the real principal, ipmt is the indexed interest and the
+    added indexation tensor is the principal's indexation, pmt = ppmt + ipmt + indexation.
+    '''
+    if schedule not in AMORTIZATION_SCHEDULES:
+        raise ValueError(f'>>> schedule must be one of {AMORTIZATION_SCHEDULES}, got {schedule}')
+    durations = np.asarray(durations)
+    months = durations.max()
+    n = durations[:, None]  # (len(durations), 1)
+    per = np.arange(months)  # periods (months) - 1
+    mask = per < n
+    r = np.asarray(monthly_rates, dtype='float64')[..., None, :months]  # (..., 1, months)
+    ppmt = mask / n  # payment against loan principal
+    if equal_amortization:
+        outstanding = 1 - per / n if schedule == 'recursive' else 1 - (per + 1) / n
+        ipmt = np.where(mask, outstanding, 0.) * r
+        pmt = ipmt + ppmt
+    elif schedule == 'recursive':
+        # with m = n - per remaining periods and v = 1 / (1 + r) the month's discount factor, the payment is
+        # balance * r / (1 - v ** m), leaving balance * (1 + r - r / (1 - v ** m)): the balances are the
+        # cumulative product of these ratios, O(n) over any array of loans
+        remaining = np.maximum(n - per, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annuity = np.where(r == 0, 1 / remaining, r / -np.expm1(-remaining * np.log1p(r)))
+        ratio = 1 + r - annuity
+        balance = np.ones_like(ratio)
+        np.cumprod(ratio[..., :-1], axis=-1, out=balance[..., 1:])
+        pmt = balance * annuity * mask
+        ipmt = balance * r * mask  # interest portion of a payment
+        ppmt = pmt - ipmt
+    else:
+        # npff.ipmt's closed form, each month at its own rate: the remaining balance after per - 1 annuity payments,
+        # from the (1 + r) ** (per - 1) compounding and the (1 + r) ** -n discount factors
+        log_growth = np.log1p(r)
+        growth = np.exp(per * log_growth)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annuity = np.where(r == 0, 1 / n, r / -np.expm1(-n * log_growth))
+        ipmt = (r * growth - annuity * (growth - 1)) * mask  # interest portion of a payment
+        pmt = (ipmt.sum(axis=-1, keepdims=True) + 1) / n * mask
+    ppmt = np.broadcast_to(ppmt, pmt.shape)
+    tensors = {'pmt': pmt, 'ipmt': ipmt, 'ppmt': ppmt}
+    if monthly_inflation is not None:
+        # the real payments scaled by the (cumulative product) madad index of their month
+        index = np.cumprod(1 + np.asarray(monthly_inflation, dtype='float64')[..., None, :months], axis=-1)
+        tensors['ipmt'] = ipmt * index
+        tensors['indexation'] = ppmt * (index - 1)
+        tensors['pmt'] = pmt * index
+    tensors = as_compute_dtype({p: tensor * principal for p, tensor in tensors.items()})
+    tensors['mask'] = mask
+    return tensors
+
+
+def amortization_totals(monthly_rates: np.ndarray,
+                        durations,
+                        equal_amortization=False,
+                        schedule=AMORTIZATION_SCHEDULE,
+                        monthly_inflation=None) -> (np.ndarray, np.ndarray):
+    '''
+    amortization_tensors' pmt summed over every duration and its first payment, per unit principal, as two
+    (..., len(durations)) float64 arrays, without building the pmt / ipmt / ppmt tensors: equal principal in
+    closed form from prefix sums over the months (every duration at once), recursive spitzer from its balances'
+    cumulative product, a duration at a time over its own months. flat spitzer falls back to the tensors.
+    '''
+    if schedule not in AMORTIZATION_SCHEDULES:
+        raise ValueError(f'>>> schedule must be one of {AMORTIZATION_SCHEDULES}, got {schedule}')
+    durations = np.asarray(durations)
+    months = durations.max()
+    r = np.asarray(monthly_rates, dtype='float64')[..., :months]
+    index = None
+    if monthly_inflation is not None:
+        index = np.cumprod(1 + np.asarray(monthly_inflation, dtype='float64')[..., :months], axis=-1)
+    if equal_amortization:
+        # pmt = (r * (1 - (t + shift) / n) + 1 / n) * index over the months t < n: three prefix sums
+        shift = 0 if schedule == 'recursive' else 1
+        weights = np.ones_like(r) if index is None else np.broadcast_to(index, np.broadcast_shapes(index.shape, r.shape))
+        weighted_r = r * weights
+        prefix = lambda x: np.cumsum(x, axis=-1)[..., durations - 1]
+        totals = (prefix(weighted_r) - prefix(weighted_r * (np.arange(months) + shift)) / durations
+                  + prefix(weights) / durations)
+        first_payments = (r[..., :1] * (1 - shift / durations) + 1 / durations) * weights[..., :1]
+        return totals, first_payments
+    if schedule != 'recursive':
+        pmt = amortization_tensors(r, durations, monthly_inflation=monthly_inflation, schedule=schedule)['pmt']
+        return pmt.sum(axis=-1, dtype='float64'), pmt[..., 0].astype('float64')
+    log_growth = np.log1p(r)
+    zero_rates = bool(np.any(r == 0))
+    shape = r.shape[:-1] if index is None else np.broadcast_shapes(r.shape[:-1], index.shape[:-1])
+    totals = np.empty(shape + (len(durations),))
+    first_payments = np.empty_like(totals)
+    for i, n in enumerate(durations):
+        rn, remaining = r[..., :n], np.arange(n, 0, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annuity = rn / -np.expm1(-remaining * log_growth[..., :n])
+        if zero_rates:
+            annuity = np.where(rn == 0, 1 / remaining, annuity)
+        balance = np.empty_like(annuity)
+        balance[..., 0] = 1
+        np.cumprod(1 + rn[..., :-1] - annuity[..., :-1], axis=-1, out=balance[..., 1:])
+        pmt = balance * annuity
+        if index is not None:
+            pmt = pmt * index[..., :n]
+        totals[..., i] = pmt.sum(axis=-1)
+        first_payments[..., i] = pmt[..., 0]
+    return totals, first_payments
+
+
+def not_a_knot_coefficients(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    # the cubic spline interpolating (x, y) with not-a-knot ends (interp1d's kind='cubic'), as (len(x) - 1, 4)
+    # coefficients of the powers of (t - x[i]) over [x[i], x[i + 1]]: value and continuous 1st & 2nd derivatives
+    # at every knot, and a continuous 3rd derivative at x[1] & x[-2]
+    x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+    n, h = len(x) - 1, np.diff(x)
+    a, b = np.zeros((4 * n, 4 * n)), np.zeros(4 * n)
+    for i in range(n):
+        a[2 * i, 4 * i] = 1
+        a[2 * i + 1, 4 * i: 4 * i + 4] = h[i] ** np.arange(4)
+        b[2 * i: 2 * i + 2] = y[i], y[i + 1]
+    for i in range(n - 1):
+        a[2 * n + 2 * i, 4 * i: 4 * i + 6] = [0, 1, 2 * h[i], 3 * h[i] ** 2, 0, -1]
+        a[2 * n + 2 * i + 1, 4 * i: 4 * i + 7] = [0, 0, 2, 6 * h[i], 0, 0, -2]
+    a[-2, [3, 7]] = 1, -1
+    a[-1, [4 * n - 5, 4 * n - 1]] = 1, -1
+    return np.linalg.solve(a, b).reshape(n, 4)
+
+
+def cubic_spline(x: list, y: list):
+    # interp1d(x, y, kind='cubic') on numpy alone: the coefficients are solved once, evaluating is a horner step
+    x = np.asarray(x, dtype='float64')
+    coefficients = not_a_knot_coefficients(x, y)
+
+    def spline(t):
+        t = np.asarray(t, dtype='float64')
+        if np.any((t < x[0]) | (t > x[-1])):
+            raise ValueError(f'>>> {t} is out of the interpolation range [{x[0]}, {x[-1]}]')
+        i = np.clip(np.searchsorted(x, t, side='right') - 1, 0, len(coefficients) - 1)
+        dt, c = t - x[i], coefficients[i]
+        return c[..., 0] + dt * (c[..., 1] + dt * (c[..., 2] + dt * c[..., 3]))
+    return spline
+
+
+# splines are built once, at import:
+fixed_yearly_risk_rate = cubic_spline([0., .45, .6, .7, .75],
+                                      [.028, .0285, .03, .0315, .0315])
+madad_added_risk_yearly_rate = cubic_spline([0., .45, .6, .7, .75],
+                                            [.018, .019, .0205, .0225, .0225])
 
 def risk_rating(funding_rate: float, is_married_couple=False) -> dict:
     un_married_rate = 1. if is_married_couple else 1.1
@@ -72,15 +303,58 @@ def risk_rating(funding_rate: float, is_married_couple=False) -> dict:
             'fixed_yearly_added_risk_rate': _fixed_yearly_risk_rate,
             'madad_yearly_added_risk_yearly_rate': _madad_added_risk_yearly_rate}
 
-def update_yearly_to_monthly_rates_with_risk(funding_rate: float, is_married_couple=False) -> dict:
+def quantize_funding_rate(funding_rate: float, funding_rate_bucket=FUNDING_RATE_BUCKET) -> float:
+    # rounding up to the bucket (the riskier side), so close requests share the same rates
+    if not funding_rate_bucket:
+        return float(funding_rate)
+    bucket_funding_rate = np.ceil(round(funding_rate / funding_rate_bucket, 9)) * funding_rate_bucket
+    return float(min(round(bucket_funding_rate, 9), MAX_FUNDING_RATE_FOR_FIRST_APPARTMENT))
+
+
+def risk_adjusted_monthly_rates(monthly_changing_yearly_madad: np.ndarray,
+                                monthly_changing_yearly_prime: np.ndarray,
+                                funding_rate: float,
+                                is_married_couple=False,
+                                index_madad_principal=INDEX_MADAD_PRINCIPAL) -> dict:
+    # yearly madad & prime curves (or (n_scenarios, months) paths of them) into the borrower's monthly rates.
+    # index_madad_principal: the madad track's (real) rate is its risk spread, the madad itself is its
+    # madad_inflation, indexing the principal
     risk = risk_rating(funding_rate, is_married_couple=is_married_couple)
-    fixed_rate = np.ones_like(monthly_changing_yearly_MADAD) * FIXED_VALUE
+    fixed_rate = np.ones_like(monthly_changing_yearly_madad) * FIXED_VALUE
     fixed_rate = fixed_rate * risk['fixed_yearly_added_risk_rate']
-    madad_rate = monthly_changing_yearly_MADAD * risk['madad_yearly_added_risk_yearly_rate']
-    prime_rate = (monthly_changing_yearly_PRIME + PRIME_ADDED_YEARLY_RATE) * risk['fixed_yearly_added_risk_rate']
-    return {'fixed_rate': yearly_rate_to_monthly(fixed_rate).astype('float16'),
-            'madad_rate': yearly_rate_to_monthly(madad_rate).astype('float16'),
-            'prime_rate': yearly_rate_to_monthly(prime_rate).astype('float16')}
+    if index_madad_principal:
+        madad_rate = np.ones_like(monthly_changing_yearly_madad) * (risk['madad_yearly_added_risk_yearly_rate'] - 1)
+    else:
+        madad_rate = monthly_changing_yearly_madad * risk['madad_yearly_added_risk_yearly_rate']
+    prime_rate = (monthly_changing_yearly_prime + PRIME_ADDED_YEARLY_RATE) * risk['fixed_yearly_added_risk_rate']
+    monthly_rates = {'fixed_rate': yearly_rate_to_monthly(fixed_rate),
+                     'madad_rate': yearly_rate_to_monthly(madad_rate),
+                     'prime_rate': yearly_rate_to_monthly(prime_rate)}
+    if index_madad_principal:
+        monthly_rates['madad_inflation'] = yearly_rate_to_monthly(monthly_changing_yearly_madad)
+    return as_compute_dtype(monthly_rates)
+
+
+@lru_cache(maxsize=RATES_CACHE_SIZE)
+def cached_monthly_rates_with_risk(funding_rate: float, is_married_couple: bool) -> dict:
+    rate_curves = get_rate_curves()
+    monthly_rates = risk_adjusted_monthly_rates(rate_curves['madad'], rate_curves['prime'],
+                                                funding_rate, is_married_couple)
+    for rate in monthly_rates.values():
+        rate.flags.writeable = False  # shared by every hit of the cache
+    return monthly_rates
+
+
+def update_yearly_to_monthly_rates_with_risk(funding_rate: float,
+                                             is_married_couple=False,
+                                             funding_rate_bucket=FUNDING_RATE_BUCKET) -> dict:
+    get_rate_curves()  # drops the cached rates of outdated curves
+    return dict(cached_monthly_rates_with_risk(quantize_funding_rate(funding_rate, funding_rate_bucket),
+                                               bool(is_married_couple)))
+
+
+rates_cache_info = cached_monthly_rates_with_risk.cache_info  # hits, misses, maxsize, currsize
+rates_cache_clear = cached_monthly_rates_with_risk.cache_clear  # whenever the madad / prime curves change
 
 
 
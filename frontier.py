@@ -0,0 +1,229 @@
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from financials import *
+from optimizer import amortization_tracks, get_payments_bank, milp_composition, principal_portions_bounds
+
+RATE_TYPES = ['fixed', 'madad', 'prime']
+
+
+def portions_polygon(set_prime_portion=None) -> (np.ndarray, list):
+    # vertices (fixed, madad, prime) of the principal portions' polygon - sum to 1 within the bounds - in
+    # circular order, and its edges (vertex index pairs)
+    bounds = principal_portions_bounds(set_prime_portion)
+    # a * madad + b * prime == c
+    lines = [(1, 0, bounds['madad'][0]), (1, 0, bounds['madad'][1]),
+             (0, 1, bounds['prime'][0]), (0, 1, bounds['prime'][1]),
+             (1, 1, 1 - bounds['fixed'][1]), (1, 1, 1 - bounds['fixed'][0])]
+    vertices = set()
+    for (a1, b1, c1), (a2, b2, c2) in combinations(lines, 2):
+        det = a1 * b2 - a2 * b1
+        if det == 0:
+            continue
+        madad, prime = (c1 * b2 - c2 * b1) / det, (a1 * c2 - a2 * c1) / det
+        fixed = 1 - madad - prime
+        if all(bounds[r][0] - 1e-9 <= p <= bounds[r][1] + 1e-9 for r, p in zip(RATE_TYPES, [fixed, madad, prime])):
+            vertices.add((round(fixed, 9), round(madad, 9), round(prime, 9)))
+    if not vertices:  # contradicting bounds
+        return np.zeros((0, 3)), []
+    vertices = np.array(sorted(vertices))
+    center = vertices.mean(axis=0)
+    vertices = vertices[np.argsort(np.arctan2(vertices[:, 2] - center[2], vertices[:, 1] - center[1]))]
+    if len(vertices) > 2:
+        edges = [(i, (i + 1) % len(vertices)) for i in range(len(vertices))]
+    else:
+        edges = [(0, 1)] if len(vertices) == 2 else []
+    return vertices, edges
+
+
+def frontier_size(equal_amortization=None, set_prime_portion=None) -> int:
+    # the points & segments FrontierPoints enumerates, cubic in the number of options per rate type
+    vertices, edges = portions_polygon(set_prime_portion)
+    n_amortizations = 2 if equal_amortization is None else 1
+    n = n_amortizations * len(DURATIONS)
+    size = (len(vertices) + len(edges)) * n ** 3
+    if n_amortizations > 1:
+        size += len(vertices) * 3 * len(DURATIONS) ** 2 * n ** 2
+    return size
+
+
+class FrontierPoints:
+    '''
+    the vertices of the (portions x durations) feasible set in the (first payment, net_payments) plane: every
+    polygon vertex with a single (amortization, duration) option per rate type. the capped optimum of every
+    durations choice lies on an edge between two of them - along a polygon edge, or splitting a rate type's
+    portion between its equal & spitzer options - so the frontier is the lower envelope of these segments.
+    '''
+    def __init__(self, monthly_rates_dictionary: dict, equal_amortization=None, set_prime_portion=None):
+        self.amortizations = ['equal', 'spitzer'] if equal_amortization is None else \
+            ['equal' if equal_amortization else 'spitzer']
+        payments_banks = {a: get_payments_bank(monthly_rates_dictionary, equal_amortization=(a == 'equal'))
+                          for a in self.amortizations}
+        # {rate type: (n_options,)} unit-principal costs of the (amortization, duration) options
+        self.options = [(a, d) for a in self.amortizations for d in DURATIONS]
+        option_totals = {r: np.concatenate([payments_banks[a].totals[r] for a in self.amortizations]) for r in RATE_TYPES}
+        option_first_payments = {r: np.concatenate([payments_banks[a].first_payments[r] for a in self.amortizations])
+                                 for r in RATE_TYPES}
+        self.vertices, self.edges = portions_polygon(set_prime_portion)
+        n = len(self.options)
+        self.shape = (len(self.vertices), n, n, n)  # the fixed, madad & prime options along the last axes
+        self.totals = self.broadcast_options(option_totals).ravel()
+        self.first_payments = self.broadcast_options(option_first_payments).ravel()
+
+    def broadcast_options(self, option_values: dict) -> np.ndarray:
+        # sum over the rate types of portion * option value, of every point
+        values = np.zeros(self.shape)
+        for t, r in enumerate(RATE_TYPES):
+            shape = [1, 1, 1]
+            shape[t] = self.shape[t + 1]
+            values += self.vertices[:, t].reshape(-1, 1, 1, 1) * option_values[r].astype('float64').reshape(shape)
+        return values
+
+    def segments(self) -> (np.ndarray, np.ndarray):
+        # (lo, hi) point indices of the segments along which the net payments decrease with the first payment
+        ids = np.arange(int(np.prod(self.shape))).reshape(self.shape)
+        lo = [ids[i].ravel() for i, _ in self.edges]
+        hi = [ids[j].ravel() for _, j in self.edges]
+        if len(self.amortizations) > 1:
+            n_durations = len(DURATIONS)
+            for t in range(3):
+                rate_ids = np.moveaxis(ids, t + 1, -1)  # the equal options first, then the spitzer ones
+                equal_ids, spitzer_ids = np.broadcast_arrays(rate_ids[..., :n_durations, None],
+                                                             rate_ids[..., None, n_durations:])
+                lo.append(equal_ids.ravel())
+                hi.append(spitzer_ids.ravel())
+        lo, hi = np.concatenate(lo), np.concatenate(hi)
+        swap = self.first_payments[lo] > self.first_payments[hi]
+        lo, hi = np.where(swap, hi, lo), np.where(swap, lo, hi)
+        keep = (self.first_payments[lo] < self.first_payments[hi]) & (self.totals[hi] < self.totals[lo])
+        return lo[keep], hi[keep]
+
+    def track_portions(self, point: int, weight=1.) -> dict:
+        # {(amortization, rate type): (portion, duration)} of a point
+        indices = np.unravel_index(point, self.shape)
+        tracks = {}
+        for t, r in enumerate(RATE_TYPES):
+            amortization, duration = self.options[indices[t + 1]]
+            tracks[(amortization, r)] = (weight * self.vertices[indices[0], t], duration)
+        return tracks
+
+
+def enumerated_frontier_rows(points: FrontierPoints, caps: np.ndarray, chunk_size=FRONTIER_CHUNK_SIZE) -> list:
+    # the cheapest point under each cap, a running minimum over the points sorted by their first payment:
+    order = np.argsort(points.first_payments, kind='stable')
+    sorted_totals = points.totals[order]
+    running_min = np.minimum.accumulate(sorted_totals)
+    running_argmin = order[np.maximum.accumulate(np.where(sorted_totals <= running_min, np.arange(len(order)), 0))]
+    k = np.searchsorted(points.first_payments[order], caps, side='right') - 1
+    net_payments = np.where(k >= 0, running_min[np.maximum(k, 0)], np.inf)
+    best = [(running_argmin[i], None, 0.) for i in np.maximum(k, 0)]
+
+    # and the cheapest segment crossing each cap:
+    lo, hi = points.segments()
+    f_lo, f_hi = points.first_payments[lo], points.first_payments[hi]
+    c_lo, c_hi = points.totals[lo], points.totals[hi]
+    for start in range(0, len(caps), chunk_size):  # bounded memory
+        chunk = caps[start:start + chunk_size, None]
+        weight = (chunk - f_lo) / (f_hi - f_lo)
+        value = np.where((f_lo <= chunk) & (chunk < f_hi), c_lo + weight * (c_hi - c_lo), np.inf)
+        s = np.argmin(value, axis=1)
+        for i, j in enumerate(s):
+            if value[i, j] < net_payments[start + i]:
+                net_payments[start + i] = value[i, j]
+                best[start + i] = (lo[j], hi[j], weight[i, j])
+
+    rows = []
+    for cap, net, (point, other, weight) in zip(caps, net_payments, best):
+        if np.isinf(net):  # no feasible composition under this cap
+            continue
+        # a segment's optimum mixes its two points, meeting the cap exactly
+        tracks = {}
+        for p, w in [(point, 1 - weight), (other, weight)]:
+            if p is None or w <= 0:
+                continue
+            for track, (portion, duration) in points.track_portions(p, w).items():
+                tracks[track] = (tracks.get(track, (0., duration))[0] + portion, duration)
+        row = {'max_first_payment_fraction': cap,
+               'first_payment': cap if other is not None else points.first_payments[point],
+               'net_payments': net}
+        for (amortization, rate), (portion, duration) in tracks.items():
+            if portion > 1e-9:
+                row[f'{amortization}_{rate}_portion'] = portion
+                row[f'{amortization}_{rate}_duration'] = duration
+        rows.append(row)
+    return rows
+
+
+def milp_frontier_rows(monthly_rates_dictionary: dict,
+                       caps: np.ndarray,
+                       equal_amortization=None,
+                       set_prime_portion=None) -> list:
+    # duration grids too fine for enumerating the points: a milp per cap, over the shared unit-principal tables
+    tracks = amortization_tracks(equal_amortization)
+    payments_banks = {a: get_payments_bank(monthly_rates_dictionary, equal_amortization=(a == 'equal'))
+                      for a in {a for a, _ in tracks}}
+    totals = np.array([payments_banks[a].totals[r] for a, r in tracks])
+    first_payments = np.array([payments_banks[a].first_payments[r] for a, r in tracks], dtype='float64')
+    rows = []
+    for cap in caps:
+        portions, net_payments = milp_composition(totals,
+                                                  first_payments,
+                                                  [r for _, r in tracks],
+                                                  principal_portions_bounds(set_prime_portion),
+                                                  cap)
+        if portions is None:  # no feasible composition under this cap
+            continue
+        row = {'max_first_payment_fraction': cap,
+               'first_payment': float((portions * first_payments).sum()),
+               'net_payments': net_payments}
+        for k, (amortization, rate) in enumerate(tracks):
+            if portions[k].sum() > 1e-9:
+                row[f'{amortization}_{rate}_portion'] = portions[k].sum()
+                row[f'{amortization}_{rate}_duration'] = DURATIONS[portions[k].argmax()]
+        rows.append(row)
+    return rows
+
+
+def efficient_frontier(funding_rate: float,
+                       is_married_couple=False,
+                       equal_amortization=None,
+                       set_prime_portion=None,
+                       n_points=FRONTIER_POINTS,
+                       chunk_size=FRONTIER_CHUNK_SIZE,
+                       distinct=True) -> pd.DataFrame:
+    '''
+    the optimal net_payments under every max_first_payment_fraction of an n_points grid over
+    1 / MAX_DURATION .. 1 / MIN_DURATION, all in one pass over the shared payments banks (the lp engine's
+    optimum, at every point). returns a row per distinct optimum: the cap it is optimal from, its first payment
+    & net_payments and the portion & duration of every track, per unit principal.
+    distinct=False keeps a row per feasible cap of the grid.
+    duration grids beyond FRONTIER_MAX_SIZE points & segments fall back to a milp per cap.
+    '''
+    monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
+    caps = np.linspace(1 / MAX_DURATION, 1 / MIN_DURATION, n_points)
+    if frontier_size(equal_amortization, set_prime_portion) > FRONTIER_MAX_SIZE:
+        rows = milp_frontier_rows(monthly_rates, caps, equal_amortization, set_prime_portion)
+    else:
+        points = FrontierPoints(monthly_rates, equal_amortization, set_prime_portion)
+        if len(points.vertices) == 0:
+            return pd.DataFrame()
+        rows = enumerated_frontier_rows(points, caps, chunk_size)
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    track_columns = sorted(c for c in df.columns if c.endswith('_portion') or c.endswith('_duration'))
+    df = df[['max_first_payment_fraction', 'first_payment', 'net_payments'] + track_columns]
+    if not distinct:
+        return df
+    return df.loc[~df.drop(columns='max_first_payment_fraction').round(12).duplicated()].reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    from time import time
+
+    principal, asset_cost = 1200000, 2150000
+    for equal_amortization in [False, None]:
+        tic = time()
+        df = efficient_frontier(principal / asset_cost, equal_amortization=equal_amortization)
+        print(f'equal_amortization={equal_amortization}: {len(df)} frontier points in {time() - tic:.3f}s')
+        print((df[['first_payment', 'net_payments']] * principal).round().astype('int64'))
@@ -1,19 +1,138 @@
 import numpy as np
-import pandas as pd
+from html import escape
+from urllib.parse import quote
 from financials import update_yearly_to_monthly_rates_with_risk
 
 make_float = lambda x: '{:,.2f}'.format(x)
 make_int = lambda x: '{:,}'.format(int(x))
 
 
-def input_args_to_df(asset_cost,
+# the report's labels, Hebrewfied (columns and cells alike):
+HEBS = {
+    'amortization_type': 'לוח סילוקין',
+    'rate_type': 'סוג ריבית',
+    'nominal_rate': 'ריבית %',
+    'duration': 'חודשי תשלום',
+    'monthly_1st_payment': 'תשלום ראשון ₪',
+    # 'monthly_max_payment': '',
+    'principal': 'קרן ₪',
+    'principal_portion': 'מרכיב קרן %',
+    'interest_paid': 'סה"כ עלות ₪',
+    'net_paid': 'סה"כ תשלום ₪',
+    'returned_ratio': 'מחיר לשקל ₪',
+    'effective_overall_rate': 'ריבית אפקטיבית %',
+
+    'spitzer': 'שפיצר',
+    'equal': 'קרן-שווה',
+
+    'fixed': 'קל"צ',
+    'madad': 'ק"צ',
+    'prime': 'פריים'
+}
+
+# design:
+STYLE = '''
+        <html>
+        <head>
+        <meta charset="utf-8" />
+        <meta name="viewport" content="width=device-width, initial-scale=1" />
+        <link rel="stylesheet" href="https://pyscript.net/latest/pyscript.css" />
+        <style>
+
+    		body {
+    			background-color: rgb(255,255,255);
+    		}
+            h2 {
+                text-align: center;
+                font-family: Helvetica, Arial, sans-serif;
+            }
+            h3 {
+                text-align: center;
+                font-family: Helvetica, Arial, sans-serif;
+            }
+            h4 {
+                text-align: center;
+                font-family: Helvetica, Arial, sans-serif;
+            }
+            h6 {
+                text-align: center;
+                font-family: Helvetica, Arial, sans-serif;
+            }
+            table { 
+    			align: center;
+                margin-left: auto;
+                margin-right: auto;
+    			background-color: rgb(255,255,255);
+            }
+            table, th, td {
+                border: 1px solid black;
+                border-collapse: collapse;
+            }
+            th, td {
+                padding: 5px;
+                text-align: center;
+                font-family: Helvetica, Arial, sans-serif;
+                font-size: 80%;
+            }
+            table tbody tr:hover {
+                background-color: #dddddd;
+            }
+
+        </style>
+        </head>
+        <body>
+        '''
+
+HEADER = STYLE + f'<h2> {"תמהיל נבחר"} </h2>' + '''
+            </body>
+            </html>
+        '''
+
+FOOTER = f'<h6> {".אין לראות את האתר והכלים בו כהמלצה פיננסית מכל סוג, ויוצריו אינם אחראיים לצעדי המשתמשים בהקשר זה"} </h6>'
+FOOTER += f'<h6> {":כל הזכויות של&nbsp;כלי חישוב המשכנתא&nbsp;שמורות ליוצר"} </h6>'
+FOOTER += f'<h6><a href="http://linkedin.com/in/natanel-davidovits-28695312" target="_blank" rel="noopener"> {"נתנאל דוידוביץ"} </a></h6>\n'
+FOOTER += '''
+            </body>
+            </html>
+        '''
+
+
+def table_head(columns: list, classes='wide') -> str:
+    # DataFrame.to_html(classes=classes, escape=False, index=False)'s markup, up to the first row
+    lines = [f'<table border="1" class="dataframe {classes}">',
+             '  <thead>',
+             '    <tr style="text-align: right;">']
+    lines += [f'      <th>{column}</th>' for column in columns]
+    lines += ['    </tr>',
+              '  </thead>',
+              '  <tbody>']
+    return '\n'.join(lines)
+
+
+def row_template(n_columns: int) -> str:
+    # a row of n_columns cells, to str.format
+    return '\n    <tr>' + '\n      <td>{}</td>' * n_columns + '\n    </tr>'
+
+
+TABLE_TAIL = '\n  </tbody>\n</table>'
+
+
+def table_to_html(table: dict, classes='wide') -> str:
+    # a {column: [cells]} table as pandas' DataFrame(table).to_html(classes=classes, escape=False, index=False)
+    # renders it, on numpy alone (no pandas in the browser)
+    row = row_template(len(table))
+    return table_head(list(table.keys()), classes) + ''.join(row.format(*cells) for cells in zip(*table.values())) + \
+        TABLE_TAIL
+
+
+def input_args_to_table(asset_cost,
                      capital,
                      max_monthly_payment,
                      net_monthly_income,
                      is_married_couple,
                      is_single_asset,
                      amortizations,
-                     prime):
+                       prime):
 
     if is_married_couple:
         is_married_couple = 'זוג'
@@ -51,42 +170,75 @@ def input_args_to_df(asset_cost,
         [make_int(asset_cost - capital) + ' ₪', 'גודל הקרן'],
         [make_float(100 * (asset_cost - capital) / asset_cost) + ' %', 'אחוז מימון'],
     ]
-    df = pd.DataFrame(input_params, columns=['בחירה (קלט)', 'פרמטר'])
-    return df
+    return {'בחירה (קלט)': [p[0] for p in input_params], 'פרמטר': [p[1] for p in input_params]}
 
 
-def stylish_html(df, title=''):
-    result = ''
-    result += '<h4> %s </h4>\n' % title
-    result += df.to_html(classes='wide', escape=False, index=False)
-    result += '''
+SECTION_TAIL = '''
     </body>
     </html>
     '''
+
+
+def stylish_html(table, title=''):
+    result = ''
+    result += '<h4> %s </h4>\n' % title
+    result += table_to_html(table, classes='wide')
+    result += SECTION_TAIL
     return result
 
 
-def df_to_summary_df(total_monthly_payments):
-    df = pd.DataFrame(data=[[make_float(total_monthly_payments['total']['pmt'].sum() /
-                                        total_monthly_payments['total']['ppmt'].sum()),
-                            make_int(total_monthly_payments['total']['pmt'].sum()),
-                            make_int(total_monthly_payments['total']['ipmt'].sum()),
-                            make_int(total_monthly_payments['total']['pmt'][0]),
-                            make_float(100 * (total_monthly_payments['total']['pmt'].sum() /
-                                        total_monthly_payments['total']['ppmt'].sum()) /
-                                       len(total_monthly_payments['total']['pmt'])),
-                            make_int(len(total_monthly_payments['total']['pmt'])),
-                            make_int(total_monthly_payments['total']['ppmt'].sum())]],
-                      columns=['מחיר משוקלל לשקל',
-                               'סה"כ לתשלום ₪',
-                               'סה"כ עלות ₪',
-                               'תשלום ראשון ₪',
-                               'ריבית משוקללת %',
-                               'חודשי תשלום',
-                               'סך הקרן ₪'])
+def cost_paid(schedule) -> float:
+    # interest, and the principal's indexation of a CPI linked (madad) track
+    return schedule['ipmt'].sum() + schedule['indexation'].sum()
+
+
+def summary_table(total_monthly_payments):
+    return {'מחיר משוקלל לשקל': [make_float(total_monthly_payments['total']['pmt'].sum() /
+                                            total_monthly_payments['total']['ppmt'].sum())],
+            'סה"כ לתשלום ₪': [make_int(total_monthly_payments['total']['pmt'].sum())],
+            'סה"כ עלות ₪': [make_int(cost_paid(total_monthly_payments['total']))],
+            'תשלום ראשון ₪': [make_int(total_monthly_payments['total']['pmt'][0])],
+            'ריבית משוקללת %': [make_float(100 * (total_monthly_payments['total']['pmt'].sum() /
+                                                  total_monthly_payments['total']['ppmt'].sum()) /
+                                           len(total_monthly_payments['total']['pmt']))],
+            'חודשי תשלום': [make_int(len(total_monthly_payments['total']['pmt']))],
+            'סך הקרן ₪': [make_int(total_monthly_payments['total']['ppmt'].sum())]}
+
+
+def frontier_to_df(frontier, principal):
+    # efficient_frontier's table in shekels, for charting: the first payment against the total paid,
+    # and how much more is paid overall than under the loosest cap. server side (the frontier is a DataFrame)
+    import pandas as pd
+    net_paid = frontier['net_payments'] * principal
+    df = pd.DataFrame({'תשלום ראשון ₪': (frontier['first_payment'] * principal).map(make_int),
+                       'סה"כ לתשלום ₪': net_paid.map(make_int),
+                       'תוספת לתשלום ₪': (net_paid - net_paid.min()).map(make_int)})
     return df
 
 
+def progress_HTML(generation, net_payments, principal):
+    # the result window's content while the optimizer runs: the de generation and the best total paid so far
+    if not generation or net_payments is None:
+        return '<h4 dir="rtl"> מחשב... </h4>'
+    return '<h4 dir="rtl"> מחשב... דור %s, סה"כ לתשלום הטוב ביותר עד כה: %s ₪ </h4>' % (
+        make_int(generation), make_int(net_payments * principal))
+
+
+def no_plan_HTML():
+    # no mix meets the max monthly payment (an infeasible cap)
+    return '<h4 dir="rtl"> לא נמצא תמהיל העומד בתשלום החודשי המקסימלי </h4>'
+
+
+def error_HTML(message):
+    # the optimizer's rejection of the inputs (validate_optimization_inputs' ValueError)
+    return f'<h4 dir="rtl"> שגיאה בנתונים </h4>\n<h6 dir="ltr"> {escape(message)} </h6>'
+
+
+def csv_download_HTML(text, filename, label):
+    # a link saving the csv text as filename (the report's full month-by-month schedules)
+    return f'<h6><a download="{filename}" href="data:text/csv;charset=utf-8,{quote(text)}"> {label} </a></h6>\n'
+
+
 def beutify_HTML(total_monthly_payments,
                  asset_cost,
                  capital,
@@ -97,7 +249,7 @@ def beutify_HTML(total_monthly_payments,
                  amortizations,
                  prime):
     principal = asset_cost - capital
-    summay_df = df_to_summary_df(total_monthly_payments)
+    summary = summary_table(total_monthly_payments)
     funding_rate = principal / asset_cost
     monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
 
@@ -141,128 +293,117 @@ def beutify_HTML(total_monthly_payments,
         d['monthly_1st_payment'].append(make_int(total_monthly_payments[k]['pmt'][0]))
         d['principal'].append(make_int(total_monthly_payments[k]['ppmt'].sum()))
         d['principal_portion'].append(make_float(100 * total_monthly_payments[k]['ppmt'].sum() / principal))
-        d['interest_paid'].append(make_int(total_monthly_payments[k]['ipmt'].sum()))
+        d['interest_paid'].append(make_int(cost_paid(total_monthly_payments[k])))
         d['net_paid'].append(make_int(total_monthly_payments[k]['pmt'].sum()))
         d['returned_ratio'].append(make_float(total_monthly_payments[k]['pmt'].sum() / total_monthly_payments[k]['ppmt'].sum()))
 
-    df = pd.DataFrame.from_dict(d)
-
-    summay_df[summay_df.columns[3]] = make_int(max_monthly_payment)
-    summay_df[summay_df.columns[-1]] = make_int(principal)
-    summay_df[summay_df.columns[-3]] = make_float(sum((df['principal_portion'].values.astype('float32') / 100) *
-                                       df['nominal_rate'].values.astype('float32')))
+    summary_columns = list(summary.keys())
+    summary[summary_columns[3]] = [make_int(max_monthly_payment)]
+    summary[summary_columns[-1]] = [make_int(principal)]
+    summary[summary_columns[-3]] = [make_float(sum((np.array(d['principal_portion']).astype('float32') / 100) *
+                                                   np.array(d['nominal_rate']).astype('float32')))]
 
     # Hebrewfy:
-    Hebs = {
-        'amortization_type': 'לוח סילוקין',
-        'rate_type': 'סוג ריבית',
-        'nominal_rate': 'ריבית %',
-        'duration': 'חודשי תשלום',
-        'monthly_1st_payment': 'תשלום ראשון ₪',
-        # 'monthly_max_payment': '',
-        'principal': 'קרן ₪',
-        'principal_portion': 'מרכיב קרן %',
-        'interest_paid': 'סה"כ עלות ₪',
-        'net_paid': 'סה"כ תשלום ₪',
-        'returned_ratio': 'מחיר לשקל ₪',
-        'effective_overall_rate': 'ריבית אפקטיבית %',
-
-        'spitzer': 'שפיצר',
-        'equal': 'קרן-שווה',
-
-        'fixed': 'קל"צ',
-        'madad': 'ק"צ',
-        'prime': 'פריים'
-    }
+    table = {HEBS.get(column, column): [HEBS.get(cell, cell) for cell in cells] for column, cells in d.items()}
 
-    df = df.replace(Hebs)
-    df = df.rename(columns=Hebs)
-
-    # design:
-    style = '''
-        <html>
-        <head>
-        <meta charset="utf-8" />
-        <meta name="viewport" content="width=device-width, initial-scale=1" />
-        <link rel="stylesheet" href="https://pyscript.net/latest/pyscript.css" />
-        <style>
-
-    		body {
-    			background-color: rgb(255,255,255);
-    		}
-            h2 {
-                text-align: center;
-                font-family: Helvetica, Arial, sans-serif;
-            }
-            h3 {
-                text-align: center;
-                font-family: Helvetica, Arial, sans-serif;
-            }
-            h4 {
-                text-align: center;
-                font-family: Helvetica, Arial, sans-serif;
-            }
-            h6 {
-                text-align: center;
-                font-family: Helvetica, Arial, sans-serif;
-            }
-            table { 
-    			align: center;
-                margin-left: auto;
-                margin-right: auto;
-    			background-color: rgb(255,255,255);
-            }
-            table, th, td {
-                border: 1px solid black;
-                border-collapse: collapse;
-            }
-            th, td {
-                padding: 5px;
-                text-align: center;
-                font-family: Helvetica, Arial, sans-serif;
-                font-size: 80%;
-            }
-            table tbody tr:hover {
-                background-color: #dddddd;
-            }
+    tables = stylish_html(table, title='תמהיל אופטמלי') + stylish_html(summary, title='סיכום')
+    # if input_args is not None:
+    input_table = input_args_to_table(asset_cost,
+                                      capital,
+                                      max_monthly_payment,
+                                      net_monthly_income,
+                                      is_married_couple,
+                                      is_single_asset,
+                                      amortizations,
+                                      prime)
+    tables = stylish_html(input_table, title='נתוני משתמש') + tables
+
+    page = HEADER + tables + FOOTER
 
-        </style>
-        </head>
-        <body>
-        '''
+    return page
 
-    # header:
-    header = style
-    header += f'<h2> {"תמהיל נבחר"} </h2>'
-    header += '''
-            </body>
-            </html>
-        '''
+# render_HTML's precompiled templates, of beutify_HTML's tables:
+MIX_COLUMNS = ['amortization_type', 'rate_type', 'nominal_rate', 'duration', 'monthly_1st_payment', 'principal',
+               'principal_portion', 'interest_paid', 'net_paid', 'returned_ratio']
+SUMMARY_COLUMNS = ['מחיר משוקלל לשקל', 'סה"כ לתשלום ₪', 'סה"כ עלות ₪', 'תשלום ראשון ₪', 'ריבית משוקללת %',
+                   'חודשי תשלום', 'סך הקרן ₪']
+INPUT_COLUMNS = ['בחירה (קלט)', 'פרמטר']
+INPUT_SECTION = '<h4> %s </h4>\n' % 'נתוני משתמש' + table_head(INPUT_COLUMNS)
+MIX_SECTION = '<h4> %s </h4>\n' % 'תמהיל אופטמלי' + table_head([HEBS[c] for c in MIX_COLUMNS])
+SUMMARY_SECTION = '<h4> %s </h4>\n' % 'סיכום' + table_head(SUMMARY_COLUMNS)
+INPUT_ROW = row_template(len(INPUT_COLUMNS))
+MIX_ROW = row_template(len(MIX_COLUMNS))
+SUMMARY_ROW = row_template(len(SUMMARY_COLUMNS))
+
+
+def render_HTML(total_monthly_payments,
+                asset_cost,
+                capital,
+                max_monthly_payment,
+                net_monthly_income,
+                is_married_couple,
+                is_single_asset,
+                amortizations,
+                prime):
+    '''
+    beutify_HTML's page, the very same markup, straight from the shekel schedules: every sum is taken and
+    every number formatted once, into the precompiled templates (no intermediate tables, label replacing or
+    re-parsing of formatted numbers).
+    '''
+    principal = asset_cost - capital
+    monthly_rates = update_yearly_to_monthly_rates_with_risk(principal / asset_cost, is_married_couple)
 
-    df = stylish_html(df, title='תמהיל אופטמלי') + stylish_html(summay_df, title='סיכום')
-    # if input_args is not None:
-    input_df = input_args_to_df(asset_cost,
-                                 capital,
-                                 max_monthly_payment,
-                                 net_monthly_income,
-                                 is_married_couple,
-                                 is_single_asset,
-                                 amortizations,
-                                 prime)
-    input_df = stylish_html(input_df, title='נתוני משתמש')
-    df = input_df + df
-
-    # footer:
-    footer = f'<h6> {".אין לראות את האתר והכלים בו כהמלצה פיננסית מכל סוג, ויוצריו אינם אחראיים לצעדי המשתמשים בהקשר זה"} </h6>'
-    footer += f'<h6> {":כל הזכויות של&nbsp;כלי חישוב המשכנתא&nbsp;שמורות ליוצר"} </h6>'
-    footer += f'<h6><a href="http://linkedin.com/in/natanel-davidovits-28695312" target="_blank" rel="noopener"> {"נתנאל דוידוביץ"} </a></h6>\n'
-    footer += '''
-            </body>
-            </html>
-        '''
-    page = header + df + footer
+    nominal_rates, rows, portions, rates = {}, [], [], []
+    for k, schedule in total_monthly_payments.items():
+        if 'total' in k:
+            continue
+        rate_type = next(a for a in ['prime', 'madad', 'fixed'] if a in k)
+        if rate_type not in nominal_rates:
+            rate = next(r for r in monthly_rates.keys() if rate_type in r)
+            nominal_rates[rate_type] = 12 * 100 * np.average(monthly_rates[rate])
+        amortization = amortizations[0] if len(amortizations) == 1 else next(a for a in amortizations if a in k)
+        net_paid, interest_paid, principal_paid = schedule['pmt'].sum(), cost_paid(schedule), schedule['ppmt'].sum()
+        principal_portion = 100 * principal_paid / principal
+        # the weighted interest of the 2 decimals shown, as beutify_HTML parses them back
+        portions.append(round(float(principal_portion), 2))
+        rates.append(round(float(nominal_rates[rate_type]), 2))
+        rows.append(MIX_ROW.format(HEBS.get(amortization, amortization),
+                                   HEBS[rate_type],
+                                   make_float(nominal_rates[rate_type]),
+                                   k.split('_')[-1],
+                                   make_int(schedule['pmt'][0]),
+                                   make_int(principal_paid),
+                                   make_float(principal_portion),
+                                   make_int(interest_paid),
+                                   make_int(net_paid),
+                                   make_float(net_paid / principal_paid)))
+
+    total = total_monthly_payments['total']
+    total_net_paid = total['pmt'].sum()
+    summary_row = SUMMARY_ROW.format(make_float(total_net_paid / total['ppmt'].sum()),
+                                     make_int(total_net_paid),
+                                     make_int(cost_paid(total)),
+                                     make_int(max_monthly_payment),
+                                     make_float(sum((np.array(portions, dtype='float32') / 100) *
+                                                    np.array(rates, dtype='float32'))),
+                                     make_int(len(total['pmt'])),
+                                     make_int(principal))
+
+    input_table = input_args_to_table(asset_cost,
+                                      capital,
+                                      max_monthly_payment,
+                                      net_monthly_income,
+                                      is_married_couple,
+                                      is_single_asset,
+                                      amortizations,
+                                      prime)
+    input_rows = ''.join(INPUT_ROW.format(*cells) for cells in zip(*input_table.values()))
+    return ''.join([HEADER,
+                    INPUT_SECTION, input_rows, TABLE_TAIL, SECTION_TAIL,
+                    MIX_SECTION, ''.join(rows), TABLE_TAIL, SECTION_TAIL,
+                    SUMMARY_SECTION, summary_row, TABLE_TAIL, SECTION_TAIL,
+                    FOOTER])
 
-    return page
 
 if __name__ == '__main__':
     ...
\ No newline at end of file
@@ -0,0 +1,119 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+
+# the stats being collected, innermost last, and the progress listeners. the hooks below are no-ops while empty
+_active = []
+_listeners = []
+_stop_requests = [0]
+
+
+class OptimizationStats:
+    '''
+    counters (objective calls, de generations, cache hits & misses, compositions rejected by the first payment
+    cap ...), seconds per phase and the differential evolution's convergence trace (per generation) of a run.
+    counted in this process only: differential_evolution's workers (de_workers > 1) evaluate out of sight.
+    '''
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.phases = defaultdict(float)
+        self.convergence = []
+
+    def as_dict(self) -> dict:
+        return {'counters': dict(self.counters), 'phases': dict(self.phases), 'convergence': list(self.convergence)}
+
+    def __repr__(self):
+        return f'OptimizationStats({self.as_dict()})'
+
+
+def is_collecting() -> bool:
+    return bool(_active)
+
+
+def count(counter: str, n=1):
+    if _active:
+        _active[-1].counters[counter] += n
+
+
+@contextmanager
+def timed(phase: str):
+    # accumulates the seconds spent in the phase (re-entering phases add up)
+    if not _active:
+        yield
+        return
+    stats = _active[-1]
+    tic = perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[phase] += perf_counter() - tic
+
+
+class TrackedObjective:
+    # an objective keeping the lowest value it returned: the evolution's best cost so far, with no evaluation of
+    # its own. tracked in this process only, as the counters are (de_workers > 1 leave it None)
+    def __init__(self, objective):
+        self.objective = objective
+        self.best = None
+
+    def __call__(self, x):
+        value = self.objective(x)
+        if self.best is None or value < self.best:
+            self.best = value
+        return value
+
+
+def tracked_objective(objective):
+    # the objective to evolve, wrapped in a TrackedObjective while there are progress listeners to report its best to
+    return TrackedObjective(objective) if _listeners else objective
+
+
+def stop_requests() -> int:
+    # the number of evolutions stopped by a listener so far: a run during which it grew is no optimum
+    return _stop_requests[0]
+
+
+def de_callback(objective=None):
+    # differential_evolution's callback, tracing the generations while collecting and reporting them to the
+    # progress listeners (None when there are neither). a listener returning True stops the evolution.
+    # objective: the evolved tracked_objective, whose best value is reported
+    if not _active and not _listeners:
+        return None
+    stats = _active[-1] if _active else None
+    listeners = list(_listeners)
+    generation = [0]
+
+    def callback(xk, convergence=None):
+        generation[0] += 1
+        if stats is not None:
+            stats.counters['de_generations'] += 1
+            stats.convergence.append(convergence)
+        if not listeners:
+            return False
+        best = getattr(objective, 'best', None)  # the best cost so far
+        stop = any([listener(generation[0], convergence, best) for listener in listeners])
+        if stop:
+            _stop_requests[0] += 1
+        return stop
+    return callback
+
+
+@contextmanager
+def progress_listener(listener):
+    # with progress_listener(listener): ... listener(generation, convergence, best cost) every de generation
+    _listeners.append(listener)
+    try:
+        yield
+    finally:
+        _listeners.remove(listener)
+
+
+@contextmanager
+def collect_stats():
+    # with collect_stats() as stats: ... the hooks of everything run within it record into stats
+    stats = OptimizationStats()
+    _active.append(stats)
+    try:
+        yield stats
+    finally:
+        _active.remove(stats)
@@ -0,0 +1,196 @@
+import numpy as np
+from financials import *
+from optimizer import JOINT_TRACKS, get_payments_bank, materialize_composition, validate_optimization_inputs
+
+TABLE_AMORTIZATIONS = [False, True, None]  # equal_amortization: spitzer, equal or both
+
+
+def prime_portions_to_array(prime_portions) -> np.ndarray:
+    return np.array([np.nan if p is None else p for p in prime_portions], dtype='float64')
+
+
+class LookupTable:
+    '''
+    the optimal compositions tabulated by build_lookup_table, over a (funding_rate, is_married_couple,
+    set_prime_portion, equal_amortization, max_first_payment_fraction) grid. a lookup re-evaluates the
+    tabulated compositions of the neighbouring funding rates, under caps up to the requested one, at the
+    actual rates, and answers the cheapest one meeting the cap, with a bound on its relative excess cost.
+    '''
+    def __init__(self, path=LOOKUP_TABLE_PATH):
+        self.path = path
+        with np.load(path) as data:
+            self.arrays = {k: data[k] for k in data.files}
+        if not set(np.unique(self.arrays['durations'])) <= set(DURATIONS) | {0}:
+            raise ValueError(f'>>> {path} was built for other DURATIONS, rebuild it')
+
+    def cell(self, is_married_couple=False, equal_amortization=None, set_prime_portion=None) -> tuple:
+        prime_portions = self.arrays['prime_portions']
+        if set_prime_portion is None:
+            p = np.flatnonzero(np.isnan(prime_portions))
+        else:
+            p = np.flatnonzero(np.isclose(prime_portions, set_prime_portion))
+        if len(p) == 0:
+            raise ValueError(f'>>> set_prime_portion must be one of the tabulated {prime_portions}, '
+                             f'got {set_prime_portion}')
+        return int(bool(is_married_couple)), int(p[0]), TABLE_AMORTIZATIONS.index(equal_amortization)
+
+    def lookup(self,
+               max_first_payment_fraction: float,
+               funding_rate: float,
+               is_married_couple=False,
+               equal_amortization=None,
+               set_prime_portion=None) -> dict:
+        # {(amortization, rate type): portion}, {(amortization, rate type): duration}, net_payments & error_bound
+        m, p, a = self.cell(is_married_couple, equal_amortization, set_prime_portion)
+        funding_rates, caps = self.arrays['funding_rates'], self.arrays['caps']
+        f_hi = min(int(np.searchsorted(funding_rates, funding_rate)), len(funding_rates) - 1)
+        f_lo = f_hi - 1 if funding_rates[f_hi] > funding_rate and f_hi > 0 else f_hi
+        c = int(np.searchsorted(caps, max_first_payment_fraction, side='right')) - 1
+        no_result = {'portions': {}, 'durations': {}, 'net_payments': np.inf, 'error_bound': np.nan}
+        if c < 0:
+            return no_result
+
+        # the candidates, under every tabulated cap up to the requested one:
+        portions = self.arrays['portions'][[f_lo, f_hi], m, p, a, :c + 1].reshape(-1, len(JOINT_TRACKS)).astype('float64')
+        durations = self.arrays['durations'][[f_lo, f_hi], m, p, a, :c + 1].reshape(-1, len(JOINT_TRACKS))
+        valid = ~np.isnan(self.arrays['net_payments'][[f_lo, f_hi], m, p, a, :c + 1].ravel())
+        portions = portions / np.where(valid, portions.sum(axis=1), 1)[:, None]  # stored in float32
+
+        # re-evaluated at the actual rates:
+        monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
+        payments_banks = {'equal': get_payments_bank(monthly_rates, equal_amortization=True),
+                          'spitzer': get_payments_bank(monthly_rates, equal_amortization=False)}
+        totals = np.array([payments_banks[am].totals[r] for am, r in JOINT_TRACKS])
+        first_payments = np.array([payments_banks[am].first_payments[r] for am, r in JOINT_TRACKS], dtype='float64')
+        tracks = np.arange(len(JOINT_TRACKS))
+        duration_indices = np.clip(np.searchsorted(DURATIONS, durations), 0, len(DURATIONS) - 1)
+        net_payments = (portions * totals[tracks, duration_indices]).sum(axis=1)
+        first_payment = (portions * first_payments[tracks, duration_indices]).sum(axis=1)
+        net_payments = np.where(valid & (first_payment <= max_first_payment_fraction), net_payments, np.inf)
+        best = int(np.argmin(net_payments))
+        if np.isinf(net_payments[best]):
+            return no_result
+
+        # rates rise with the funding rate and the optimum falls with the cap, hence a lower bound from the
+        # lower funding rate under the next cap:
+        c_hi = c if caps[c] >= max_first_payment_fraction else min(c + 1, len(caps) - 1)
+        lower_bound = self.arrays['net_payments'][f_lo, m, p, a, c_hi]
+        return {'portions': {JOINT_TRACKS[k]: portions[best, k] for k in tracks if portions[best, k] > 0},
+                'durations': {JOINT_TRACKS[k]: int(durations[best, k]) for k in tracks if portions[best, k] > 0},
+                'net_payments': float(net_payments[best]),
+                'error_bound': float(max(net_payments[best] / lower_bound - 1, 0.))}
+
+
+_lookup_tables = {}
+
+
+def get_lookup_table(path=LOOKUP_TABLE_PATH) -> LookupTable:
+    # loaded once per path
+    if path not in _lookup_tables:
+        _lookup_tables[path] = LookupTable(path)
+    return _lookup_tables[path]
+
+
+def table_optimize(max_first_payment_fraction: float,
+                   funding_rate: float,
+                   is_married_couple=False,
+                   equal_amortization=None,
+                   set_prime_portion=None,
+                   path=LOOKUP_TABLE_PATH) -> (dict, float):
+    # optimizer.optimize(engine='table'): the same results structure, from the lookup table
+    validate_optimization_inputs(max_first_payment_fraction, funding_rate)
+    found = get_lookup_table(path).lookup(max_first_payment_fraction,
+                                          funding_rate,
+                                          is_married_couple=is_married_couple,
+                                          equal_amortization=equal_amortization,
+                                          set_prime_portion=set_prime_portion)
+    if not found['portions']:
+        return {}, found['net_payments']
+    monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
+    optimal_result = {}
+    for amortization in ['equal', 'spitzer']:
+        if equal_amortization is not None and (amortization == 'equal') != bool(equal_amortization):
+            continue
+        optimal_result[f'{amortization}_optimal_result'] = materialize_composition(
+            get_payments_bank(monthly_rates, equal_amortization=(amortization == 'equal')),
+            {r: portion for (am, r), portion in found['portions'].items() if am == amortization},
+            {r: duration for (am, r), duration in found['durations'].items() if am == amortization})
+    if equal_amortization is not None:
+        optimal_result = optimal_result[f"{'equal' if equal_amortization else 'spitzer'}_optimal_result"]
+    return optimal_result, found['net_payments']
+
+
+def build_lookup_table(path=LOOKUP_TABLE_PATH,
+                       n_funding_rates=TABLE_FUNDING_RATES,
+                       n_caps=TABLE_FIRST_PAYMENT_POINTS,
+                       prime_portions=TABLE_PRIME_PORTIONS,
+                       validation_samples=TABLE_VALIDATION_SAMPLES,
+                       seed=SEED) -> dict:
+    '''
+    offline: the lp optimum of every grid cell (the efficient frontier gives all the caps of a cell at once),
+    saved to a compressed .npz. validated against optimize(engine='lp') on random off grid inputs, whose
+    relative errors are saved along and returned as a report.
+    '''
+    from frontier import efficient_frontier
+    from optimizer import optimize
+
+    funding_rates = np.linspace(0, MAX_FUNDING_RATE_FOR_FIRST_APPARTMENT, n_funding_rates)
+    caps = np.linspace(1 / MAX_DURATION, 1 / MIN_DURATION, n_caps)
+    shape = (n_funding_rates, 2, len(prime_portions), len(TABLE_AMORTIZATIONS), n_caps)
+    arrays = {'funding_rates': funding_rates,
+              'caps': caps,
+              'prime_portions': prime_portions_to_array(prime_portions),
+              'portions': np.zeros(shape + (len(JOINT_TRACKS),), dtype='float32'),
+              'durations': np.zeros(shape + (len(JOINT_TRACKS),), dtype='int16'),
+              'net_payments': np.full(shape, np.nan)}
+    for index in np.ndindex(shape[:-1]):
+        f, m, p, a = index
+        df = efficient_frontier(funding_rates[f], bool(m), TABLE_AMORTIZATIONS[a], prime_portions[p],
+                                n_points=n_caps, distinct=False)
+        if df.empty:  # contradicting bounds
+            continue
+        c = np.searchsorted(caps, df['max_first_payment_fraction'].values)
+        arrays['net_payments'][index][c] = df['net_payments'].values
+        for k, (amortization, rate) in enumerate(JOINT_TRACKS):
+            if f'{amortization}_{rate}_portion' in df:
+                arrays['portions'][index][c, k] = df[f'{amortization}_{rate}_portion'].fillna(0).values
+                arrays['durations'][index][c, k] = df[f'{amortization}_{rate}_duration'].fillna(0).values
+    np.savez_compressed(path, **arrays)
+
+    rng = np.random.default_rng(seed)
+    table = LookupTable(path)
+    errors, error_bounds = [], []
+    for _ in range(validation_samples):
+        inputs = (rng.uniform(1 / MAX_DURATION, 1 / MIN_DURATION),
+                  rng.uniform(0.01, MAX_FUNDING_RATE_FOR_FIRST_APPARTMENT),
+                  bool(rng.integers(2)),
+                  TABLE_AMORTIZATIONS[rng.integers(len(TABLE_AMORTIZATIONS))],
+                  prime_portions[rng.integers(len(prime_portions))])
+        try:
+            _, net_payments = optimize(*inputs, engine='lp')
+        except ValueError:
+            continue
+        found = table.lookup(*inputs)
+        if np.isinf(net_payments) or np.isinf(found['net_payments']):
+            continue
+        errors.append(found['net_payments'] / net_payments - 1)
+        error_bounds.append(found['error_bound'])
+    arrays['validation_errors'] = np.array(errors)
+    arrays['validation_error_bounds'] = np.array(error_bounds)
+    np.savez_compressed(path, **arrays)
+    _lookup_tables.pop(path, None)
+    errors = arrays['validation_errors']
+    return {'samples': len(errors),
+            'max_error': float(errors.max()) if len(errors) else np.nan,
+            'mean_error': float(errors.mean()) if len(errors) else np.nan,
+            'bound_violations': int((errors > arrays['validation_error_bounds'] + 1e-9).sum())}
+
+
+if __name__ == '__main__':
+    from time import time
+
+    tic = time()
+    print(build_lookup_table(), f'built in {time() - tic:.1f}s')
+    tic = time()
+    optimal_result, net_payments = table_optimize(6718 / 1200000, 1200000 / 2150000, equal_amortization=False)
+    print(f'net payments: {net_payments}, looked up in {time() - tic:.4f}s')
@@ -1,5 +1,9 @@
-from optimizer import optimize
+import json
+from instrumentation import timed
+from plan import MortgagePlan
+from worker_protocol import BROWSER_ENGINE, plan_from_json, load_engine_packages
 from htmling import *
+from export import schedules_csv
 
 try:
     from pyscript import document, window
@@ -14,8 +18,51 @@ warnings.filterwarnings('ignore')
 from pprint import PrettyPrinter
 pp = PrettyPrinter().pprint
 
+# the optimizer worker's runs: a click supersedes (cancels) the running one, which stops at its next generation
+runs = {'current': 0, 'windows': {}, 'principals': {}}
+_optimizer = {}
 
-def func(event):
+
+def report_progress(run_id, generation, net_payments) -> bool:
+    # called by the worker (synchronously) every de generation, True while the run is still the current one
+    if run_id != runs['current']:
+        return False
+    if run_id in runs['windows']:
+        runs['windows'][run_id].document.body.innerHTML = progress_HTML(generation, net_payments,
+                                                                        runs['principals'][run_id])
+    return True
+
+
+async def get_optimizer():
+    # index.html's optimizer worker, None where workers can't run (sync needs a cross origin isolated page):
+    # then main.func optimizes on the page's thread, with a session kept across the clicks
+    if 'optimizer' not in _optimizer:
+        try:
+            from pyscript import workers
+            from pyodide.ffi import create_proxy
+            worker = document.querySelector("script[name='optimizer']")
+            worker.xworker.sync.report_progress = create_proxy(report_progress)
+            _optimizer['optimizer'] = await workers['optimizer']
+        except (ModuleNotFoundError, ImportError, AttributeError):
+            from session import OptimizerSession
+            _optimizer['optimizer'] = None
+            _optimizer['session'] = OptimizerSession(engine=BROWSER_ENGINE)
+            await load_engine_packages(_optimizer['session'].engine)
+    return _optimizer['optimizer']
+
+
+def close_run_windows():
+    for run_id in list(runs['windows'].keys()):
+        runs['windows'].pop(run_id).close()
+        runs['principals'].pop(run_id, None)
+
+
+def cancel(event):
+    runs['current'] += 1
+    close_run_windows()
+
+
+def read_inputs() -> dict:
     asset_cost = int(document.querySelector("#asset_cost").value)
     capital = int(document.querySelector("#capital").value)
     net_monthly_income = int(document.querySelector("#net_monthly_income").value)
@@ -40,63 +87,75 @@ def func(event):
     else:
         _prime = 2 / 3
 
+    return {'asset_cost': asset_cost,
+            'capital': capital,
+            'net_monthly_income': net_monthly_income,
+            'max_monthly_payment': max_monthly_payment,
+            'amortizations': amortizations,
+            'equal_amortization': equal_amortization,
+            'is_married_couple': is_married_couple,
+            'is_single_asset': is_single_asset,
+            'prime': prime,
+            'set_prime_portion': _prime}
+
+
+def optimize_inputs(inputs: dict) -> dict:
     # mortgage calculation:
-    principal = asset_cost - capital
-    max_first_payment_fraction = max_monthly_payment / principal
-    funding_rate = principal / asset_cost
-    optimal_result, net_payments = optimize(max_first_payment_fraction,
-                                            funding_rate,
-                                            is_married_couple=is_married_couple,
-                                            equal_amortization=equal_amortization,
-                                            set_prime_portion=_prime)
-
-    # weighted interest:
-        # flattening the dict:
-    _optimal_result = {}
-    if any(map(lambda x: any([(y in x) for y in ['prime', 'madad', 'fixed']]), optimal_result.keys())): # single type of amortization
-        for k1 in optimal_result.keys():
-            duration = list(optimal_result[k1].keys())[0]
-            _optimal_result[f'{k1}_{duration}'] = optimal_result[k1][duration]
-    else:
-        for k1 in ['equal_optimal_result', 'spitzer_optimal_result']:
-            for k2 in optimal_result[k1].keys():
-                duration = list(optimal_result[k1][k2].keys())[0]
-                _optimal_result[f'{k1.split("_")[0]}_{k2}_{duration}'] = optimal_result[k1][k2][duration]
-    optimal_result = _optimal_result
-    del _optimal_result
-
-    # adding the sum (tot) of amortizations:
-    array_length = []
-    for k1, v in optimal_result.items():
-        array_length.append(int(k1.split('_')[-1]))
-    tot_pmt = np.zeros(max(array_length))
-    tot_ipmt = np.zeros(max(array_length))
-    tot_ppmt = np.zeros(max(array_length))
-    for k1, v in optimal_result.items():
-        duration = int(k1.split('_')[-1])
-        tot_pmt[:duration] = tot_pmt[:duration] + v['pmt']
-        tot_ipmt[:duration] = tot_ipmt[:duration] + v['ipmt']
-        tot_ppmt[:duration] = tot_ppmt[:duration] + v['ppmt']
-    optimal_result['total'] = {'pmt': tot_pmt, 'ipmt': tot_ipmt, 'ppmt': tot_ppmt}
-
-    # updating total_monthly_payments to real cost:
-    total_monthly_payments = {}
-    for k1 in optimal_result.keys():
-        total_monthly_payments[k1] = {}
-        for p in ['pmt', 'ipmt', 'ppmt']:
-            total_monthly_payments[k1][p] = np.ceil(optimal_result[k1][p] * principal).astype('int32')
-
-    html_out = beutify_HTML(total_monthly_payments,
-                            asset_cost,
-                            capital,
-                            max_monthly_payment,
-                            net_monthly_income,
-                            is_married_couple,
-                            is_single_asset,
-                            amortizations,
-                            prime)
+    principal = inputs['asset_cost'] - inputs['capital']
+    return {'max_first_payment_fraction': inputs['max_monthly_payment'] / principal,
+            'funding_rate': principal / inputs['asset_cost'],
+            'is_married_couple': inputs['is_married_couple'],
+            'equal_amortization': inputs['equal_amortization'],
+            'set_prime_portion': inputs['set_prime_portion']}
+
 
+def report_HTML(plan: MortgagePlan, inputs: dict) -> str:
+    if not len(plan):
+        return no_plan_HTML()
+    principal = inputs['asset_cost'] - inputs['capital']
+    # the tracks & their total, in real cost:
+    total_monthly_payments = plan.payments(principal)
+
+    html_out = render_HTML(total_monthly_payments,
+                           inputs['asset_cost'],
+                           inputs['capital'],
+                           inputs['max_monthly_payment'],
+                           inputs['net_monthly_income'],
+                           inputs['is_married_couple'],
+                           inputs['is_single_asset'],
+                           inputs['amortizations'],
+                           inputs['prime'])
+    return html_out + csv_download_HTML(schedules_csv(total_monthly_payments), 'schedules.csv', 'לוח סילוקין מלא (CSV)')
+
+
+async def func(event):
+    inputs = read_inputs()
+    runs['current'] += 1
+    run_id = runs['current']
+    close_run_windows()
+    # opened on the click itself (popup blockers), showing the progress until the result replaces it
     new = window.open()
+    runs['windows'][run_id] = new
+    runs['principals'][run_id] = inputs['asset_cost'] - inputs['capital']
+    new.document.body.innerHTML = progress_HTML(0, None, runs['principals'][run_id])
+
+    optimizer = await get_optimizer()
+    try:
+        if optimizer is None:
+            optimal_result, net_payments = _optimizer['session'].optimize(**optimize_inputs(inputs))
+            plan = MortgagePlan.from_result(optimal_result, net_payments, inputs['equal_amortization'])
+        else:
+            result = await optimizer.run_optimize(run_id, json.dumps(optimize_inputs(inputs)))
+            if result is None or run_id != runs['current']:  # cancelled, or superseded by a later click
+                return
+            plan = plan_from_json(result)
+        with timed('html'):
+            html_out = report_HTML(plan, inputs)
+    except ValueError as e:  # inputs the optimizer rejects, on either thread
+        html_out = error_HTML(str(e))
+    finally:
+        runs['windows'].pop(run_id, None)
+        runs['principals'].pop(run_id, None)
     new.document.body.innerHTML = html_out
 
 # # for testing
@@ -1,187 +1,579 @@
-from scipy.optimize import differential_evolution, NonlinearConstraint
-
-try:
-    import requests
-except:
-    pass
-    # import pyodide_js
-    # await pyodide_js.loadPackage('requests')
+from collections import OrderedDict
 
 from financials import *
+from instrumentation import collect_stats, count, de_callback, is_collecting, timed, tracked_objective
 
 import warnings
 warnings.filterwarnings('ignore')
 
 
+AMORTIZATIONS = ['prime', 'madad', 'fixed']
+# the optimize() engines solved by scipy.optimize, imported on their first use only (the browser's lite runtime
+# loads scipy on demand): 'table' and the composition searches run on numpy alone, lacking the table file
+# 'table' falls back to 'lp'
+SCIPY_ENGINES = ['de', 'lp']
+
+
+def tensors_to_schedules(tensors: dict, index=()) -> dict:
+    # {duration: schedule} views of amortization_tensors' (len(DURATIONS), max(DURATIONS)) tensors at index
+    return {n: {p: tensor[index + (i, slice(n))] for p, tensor in tensors.items() if p != 'mask'}
+            for i, n in enumerate(DURATIONS)}
+
+
 def monthly_payment_bank(monthly_rate: np.ndarray, equal_amortization=False):
-    if equal_amortization:
-        amortization_function = get_equal_amortization
-    else:
-        amortization_function = get_spitzer_amortization
-    return dict(map(lambda n: (n, amortization_function(monthly_rate, n, 1)), DURATIONS))
+    return tensors_to_schedules(amortization_tensors(monthly_rate, DURATIONS, equal_amortization=equal_amortization))
+
+
+def tri_amortization_tensors(monthly_rates_dictionary: dict, equal_amortization=False) -> dict:
+    # the three rate types (AMORTIZATIONS order) and all the DURATIONS in one batched call.
+    # a madad_inflation rate indexes the madad track's principal
+    months = min(len(monthly_rates_dictionary[f'{amortization}_rate']) for amortization in AMORTIZATIONS)
+    monthly_inflation = None
+    if 'madad_inflation' in monthly_rates_dictionary:
+        monthly_inflation = np.zeros((len(AMORTIZATIONS), months))
+        monthly_inflation[AMORTIZATIONS.index('madad')] = monthly_rates_dictionary['madad_inflation'][:months]
+    return amortization_tensors(np.stack([monthly_rates_dictionary[f'{amortization}_rate'][:months]
+                                          for amortization in AMORTIZATIONS]),
+                                DURATIONS,
+                                equal_amortization=equal_amortization,
+                                monthly_inflation=monthly_inflation)
 
 
 def tri_amortization_composition_duration_variable(monthly_rates_dictionary: dict, equal_amortization=False) -> dict:
-    payments_bank = {}
-    for amortization in ['prime', 'madad', 'fixed']:
-        payments_bank[f'{amortization}_monthly_payments'] = (
-            monthly_payment_bank(monthly_rates_dictionary[f'{amortization}_rate'], equal_amortization))
+    tensors = tri_amortization_tensors(monthly_rates_dictionary, equal_amortization=equal_amortization)
+    return {f'{amortization}_monthly_payments': tensors_to_schedules(tensors, (t,))
+            for t, amortization in enumerate(AMORTIZATIONS)}
+
+
+class PaymentsBank:
+    # unit-principal schedules of every rate type and duration, depending only on the rates (not on the portions).
+    # built once per (monthly_rates_dictionary, equal_amortization) and shared by all the objective evaluations.
+    def __init__(self, monthly_rates_dictionary: dict, equal_amortization=False, storage_dtype=None):
+        self.equal_amortization = equal_amortization
+        tensors = tri_amortization_tensors(monthly_rates_dictionary, equal_amortization=equal_amortization)
+        # presumming, for later efficiency (the tensors are zero padded beyond each duration):
+        totals = tensors['pmt'].sum(axis=-1).astype('float64')
+        self.totals = {}  # {rate type: pmt.sum() per duration}
+        self.first_payments = {}  # {rate type: pmt[0] per duration}
+        for t, amortization in enumerate(AMORTIZATIONS):
+            self.totals[amortization] = totals[t]
+            self.first_payments[amortization] = tensors['pmt'][t, :, 0].copy()
+        # (3, len(DURATIONS), max(DURATIONS)) pmt, ipmt, ppmt [, indexation]. the totals are kept in full precision
+        self.tensors = {p: tensor.astype(storage_dtype or tensor.dtype, copy=False)
+                        for p, tensor in tensors.items() if p != 'mask'}
+        self.schedules = {f'{amortization}_monthly_payments': tensors_to_schedules(self.tensors, (t,))
+                          for t, amortization in enumerate(AMORTIZATIONS)}
+
+    def nbytes(self) -> int:
+        return sum(tensor.nbytes for tensor in self.tensors.values())
+
+    def schedule(self, amortization: str, duration: int, portion: float) -> dict:
+        bank = self.schedules[f'{amortization}_monthly_payments'][duration]
+        return {p: payments * portion for p, payments in bank.items()}
+
+
+_payments_bank_cache = OrderedDict()
+
+
+def get_payments_bank(monthly_rates_dictionary: dict, equal_amortization=False) -> PaymentsBank:
+    key = (bool(equal_amortization), DTYPE_POLICY['storage']) + tuple((k, v.dtype.str, v.tobytes())
+                                                                      for k, v in sorted(monthly_rates_dictionary.items()))
+    if key in _payments_bank_cache:
+        count('payments_bank_hits')
+        _payments_bank_cache.move_to_end(key)
+        return _payments_bank_cache[key]
+    count('payments_bank_misses')
+    with timed('payments_bank'):
+        payments_bank = PaymentsBank(monthly_rates_dictionary,
+                                     equal_amortization=equal_amortization,
+                                     storage_dtype=DTYPE_POLICY['storage'])
+    _payments_bank_cache[key] = payments_bank
+    if len(_payments_bank_cache) > PAYMENTS_BANK_CACHE_SIZE:
+        _payments_bank_cache.popitem(last=False)
     return payments_bank
 
 
+def loop_composition_search(totals: dict, first_payments: dict, max_first_payment_fraction: float) -> (tuple, float):
+    # reference implementation: scoring every (d1, d2, d3) triple one by one
+    net_payments = np.inf
+    optimal_indices = None
+    rejected = 0
+    for i1 in range(len(DURATIONS)): # fixed_monthly_payments
+        for i2 in range(len(DURATIONS)): # madad_monthly_payments
+            for i3 in range(len(DURATIONS)): # prime_monthly_payments
+                tot = totals['fixed'][i1] + totals['madad'][i2] + totals['prime'][i3]
+                if tot < net_payments:
+                    first_payment = first_payments['fixed'][i1] + first_payments['madad'][i2] + first_payments['prime'][i3]
+                    if max_first_payment_fraction < first_payment:
+                        rejected += 1
+                        continue
+                    optimal_indices = (i1, i2, i3)
+                    net_payments = tot
+    count('compositions_evaluated', len(DURATIONS) ** 3)
+    count('compositions_rejected_by_cap', rejected)
+    return optimal_indices, net_payments
+
+
+def vectorized_composition_search(totals: dict, first_payments: dict, max_first_payment_fraction: float) -> (tuple, float):
+    # the total cost is separable per rate track, only the first payment couples them:
+    # broadcasting over a (len(DURATIONS),) * 3 tensor, masking by the first payment and taking the (first) argmin
+    tot = (totals['fixed'][:, None, None] + totals['madad'][None, :, None]) + totals['prime'][None, None, :]
+    first_payment = ((first_payments['fixed'][:, None, None] + first_payments['madad'][None, :, None]) +
+                     first_payments['prime'][None, None, :])
+    under_cap = first_payment.astype('float64') <= max_first_payment_fraction
+    if is_collecting():
+        count('compositions_evaluated', tot.size)
+        count('compositions_rejected_by_cap', tot.size - int(under_cap.sum()))
+    tot = np.where(under_cap, tot, np.inf)
+    flat_index = np.argmin(tot)
+    net_payments = tot.flat[flat_index]
+    if np.isinf(net_payments):
+        return None, np.inf
+    return np.unravel_index(flat_index, tot.shape), net_payments
+
+
+def pareto_front(tot: np.ndarray, first_payment: np.ndarray, max_first_payment_fraction: float) -> np.ndarray:
+    # indices of the candidates under the cap which are not dominated (no other one has both lower first payment
+    # and lower total), by increasing first payment - hence decreasing total
+    order = np.lexsort((tot, first_payment))
+    order = order[first_payment[order] <= max_first_payment_fraction]
+    count('compositions_evaluated', len(tot))
+    count('compositions_rejected_by_cap', len(tot) - len(order))
+    running_min = np.minimum.accumulate(tot[order])
+    return order[tot[order] < np.concatenate([[np.inf], running_min[:-1]])]
+
+
+def fold_track(indices: np.ndarray,
+               tot: np.ndarray,
+               first_payment: np.ndarray,
+               track_totals: np.ndarray,
+               track_first_payments: np.ndarray,
+               front: np.ndarray,
+               max_first_payment_fraction: float) -> (np.ndarray, np.ndarray, np.ndarray):
+    # the pareto front of the partial compositions (by increasing first payment) extended by the front of one more
+    # track. exact while there are up to PARETO_FOLD_MAX_SIZE candidates, otherwise a dynamic program over
+    # PARETO_FOLD_GRID first payment breakpoints up to the cap: the cheapest extension under every breakpoint
+    # (the partial front is a staircase, its cheapest composition under a first payment is a sorted search)
+    if len(tot) * len(front) <= PARETO_FOLD_MAX_SIZE:
+        n = len(front)
+        indices = np.hstack([np.repeat(indices, n, axis=0), np.tile(front, len(tot))[:, None]])
+        tot = (tot[:, None] + track_totals[front][None, :]).ravel()
+        first_payment = (first_payment[:, None] + track_first_payments[front][None, :]).ravel()
+    else:
+        breakpoints = max_first_payment_fraction * np.arange(1, PARETO_FOLD_GRID + 1) / PARETO_FOLD_GRID
+        j = np.searchsorted(first_payment, breakpoints[:, None] - track_first_payments[front][None, :], side='right') - 1
+        candidates = np.where(j >= 0, tot[np.maximum(j, 0)] + track_totals[front][None, :], np.inf)
+        count('compositions_evaluated', candidates.size)
+        best = np.argmin(candidates, axis=1)
+        j = j[np.arange(len(breakpoints)), best]
+        feasible = j >= 0
+        j, best = j[feasible], best[feasible]
+        indices = np.hstack([indices[j], front[best][:, None]])
+        tot = tot[j] + track_totals[front[best]]
+        first_payment = first_payment[j] + track_first_payments[front[best]]
+    order = pareto_front(tot, first_payment, max_first_payment_fraction)
+    return indices[order], tot[order], first_payment[order]
+
+
+def pareto_composition_search(totals: np.ndarray, first_payments: np.ndarray, max_first_payment_fraction: float) -> (tuple, float):
+    # totals / first_payments: (n_tracks, n_durations). every track is first pruned to its own pareto front, under
+    # the cap left by the other tracks' lowest first payments. the tracks but the last are then folded in one by one
+    # (fold_track), keeping the pareto front of the partial compositions, and the last track is a sorted search: the
+    # cheapest of its front under the first payment left by each partial composition.
+    # exact on coarse duration grids. once a fold is bounded to its breakpoints, the result is the optimum under a
+    # cap tightened by at most a breakpoint spacing (max_first_payment_fraction / PARETO_FOLD_GRID) per such fold
+    min_first_payments = first_payments.min(axis=1)
+    slack = max_first_payment_fraction - (min_first_payments.sum() - min_first_payments)
+    fronts = [pareto_front(t, f, s) for t, f, s in zip(totals, first_payments, slack)]
+    if any(len(front) == 0 for front in fronts):
+        return None, np.inf
+    indices = np.zeros((1, 0), dtype='int64')
+    tot, first_payment = np.zeros(1), np.zeros(1)
+    for k, front in enumerate(fronts[:-1]):
+        indices, tot, first_payment = fold_track(indices, tot, first_payment, totals[k], first_payments[k], front,
+                                                 max_first_payment_fraction - min_first_payments[k + 1:].sum())
+        if len(tot) == 0:
+            return None, np.inf
+    last = fronts[-1]
+    j = np.searchsorted(first_payments[-1, last], max_first_payment_fraction - first_payment, side='right') - 1
+    tot = np.where(j >= 0, tot + totals[-1, last[np.maximum(j, 0)]], np.inf)
+    best = np.argmin(tot)
+    if np.isinf(tot[best]):
+        return None, np.inf
+    return tuple(indices[best]) + (last[j[best]],), tot[best]
+
+
+def sorted_composition_search(totals: dict, first_payments: dict, max_first_payment_fraction: float) -> (tuple, float):
+    rate_types = ['fixed', 'madad', 'prime']
+    return pareto_composition_search(np.array([totals[a] for a in rate_types]),
+                                     np.array([first_payments[a] for a in rate_types], dtype='float64'),
+                                     max_first_payment_fraction)
+
+
+COMPOSITION_ENGINES = {'vectorized': vectorized_composition_search,
+                       'pareto': sorted_composition_search,
+                       'loop': loop_composition_search}
+
+
+def auto_composition_engine() -> str:
+    # the (len(DURATIONS),) * 3 tensor for coarse duration grids, the pruned sorted search for the finer ones
+    return 'vectorized' if len(DURATIONS) ** 3 <= VECTORIZED_COMPOSITION_MAX_SIZE else 'pareto'
+
+
 def get_optimized_composition(monthly_rates_dictionary: dict,
                               principal_portions: dict,
                               max_first_payment_fraction: float,
-                              equal_amortization=False) -> (dict, float):
+                              equal_amortization=False,
+                              payments_bank: PaymentsBank = None,
+                              engine='auto') -> (dict, float):
     # principal_portions = {'fixed': 0.6, 'madad': 0.6, 'prime': 0.6}
     if not all(list(map(lambda x: (type(x) is float) or (type(x) is np.float_), list(principal_portions.values())))):
         raise ValueError('>>> type(values) != float')
     if sum(principal_portions.values()) != 1:
         raise ValueError('>>> sum(values) != 1')
-    payments_bank = tri_amortization_composition_duration_variable(monthly_rates_dictionary,
-                                                                   equal_amortization=equal_amortization)
-    # presumming, for later efficiency:
-    _payments_bank = {}
-    for monthly_payments in payments_bank.keys():
-        _payments_bank[monthly_payments] = {}
-        for duration in payments_bank[monthly_payments].keys():
-            _payments_bank[monthly_payments][duration] = (payments_bank[monthly_payments][duration]['pmt'].sum() *
-                                                          principal_portions[monthly_payments.split('_')[0]])
-
-    net_payments = np.inf
+    if engine == 'auto':
+        engine = auto_composition_engine()
+    if engine not in COMPOSITION_ENGINES:
+        raise ValueError(f'>>> engine must be one of {list(COMPOSITION_ENGINES)}, got {engine}')
+    if payments_bank is None:
+        payments_bank = get_payments_bank(monthly_rates_dictionary, equal_amortization=equal_amortization)
+    totals = {a: payments_bank.totals[a] * principal_portions[a] for a in ['fixed', 'madad', 'prime']}
+    first_payments = {a: payments_bank.first_payments[a] * principal_portions[a] for a in ['fixed', 'madad', 'prime']}
+
+    optimal_indices, net_payments = COMPOSITION_ENGINES[engine](totals, first_payments, max_first_payment_fraction)
+
+    # materializing the arrays of the winning triple only:
     optimal_result = {}
-    for d1 in DURATIONS: # fixed_monthly_payments
-        for d2 in DURATIONS: # madad_monthly_payments
-            for d3 in DURATIONS: # prime_monthly_payments
-                tot = (_payments_bank['fixed_monthly_payments'][d1] +
-                       _payments_bank['madad_monthly_payments'][d2] +
-                       _payments_bank['prime_monthly_payments'][d3])
-                if tot < net_payments:
-                    fixed_pmt = payments_bank['fixed_monthly_payments'][d1]['pmt'] * principal_portions['fixed']
-                    madad_pmt = payments_bank['madad_monthly_payments'][d2]['pmt'] * principal_portions['madad']
-                    prime_pmt = payments_bank['prime_monthly_payments'][d3]['pmt'] * principal_portions['prime']
-                    if max_first_payment_fraction < fixed_pmt[0] + madad_pmt[0] + prime_pmt[0]:
-                        continue
-                    fixed, madad, prime = {}, {}, {}
-                    for p in ['pmt', 'ipmt', 'ppmt']:
-                        fixed[p] = payments_bank['fixed_monthly_payments'][d1][p] * principal_portions['fixed']
-                        madad[p] = payments_bank['madad_monthly_payments'][d2][p] * principal_portions['madad']
-                        prime[p] = payments_bank['prime_monthly_payments'][d3][p] * principal_portions['prime']
-
-                    optimal_result = {'fixed_monthly_payments': {d1: fixed},
-                                      'madad_monthly_payments': {d2: madad},
-                                      'prime_monthly_payments': {d3: prime}}
-                    net_payments = tot
+    if optimal_indices is not None:
+        optimal_result = materialize_composition(payments_bank,
+                                                 principal_portions,
+                                                 dict(zip(['fixed', 'madad', 'prime'],
+                                                          [DURATIONS[i] for i in optimal_indices])))
     return optimal_result, net_payments
 
 
+def materialize_composition(payments_bank: PaymentsBank, principal_portions: dict, durations: dict) -> dict:
+    optimal_result = {}
+    for a in ['fixed', 'madad', 'prime']:
+        if principal_portions.get(a, 0) > 0:
+            d = durations[a]
+            optimal_result[f'{a}_monthly_payments'] = {d: payments_bank.schedule(a, d, principal_portions[a])}
+    return optimal_result
+
+
+def principal_portions_bounds(set_prime_portion=None) -> dict:
+    if set_prime_portion is None:
+        return {'fixed': (MIN_FIXED_PORTION, 1),
+                'madad': (MIN_UNFIXED_PORTON, MAX_UNFIXED_PORTON),
+                'prime': (MIN_UNFIXED_PORTON, MAX_UNFIXED_PORTON)}
+    return {'fixed': (MIN_FIXED_PORTION, 1),
+            'madad': (MIN_UNFIXED_PORTON, MAX_UNFIXED_PORTON - set_prime_portion),
+            'prime': (set_prime_portion, set_prime_portion)}
+
+
+def milp_composition(totals: np.ndarray,
+                     first_payments: np.ndarray,
+                     rate_types: list,
+                     portions_bounds: dict,
+                     max_first_payment_fraction: float) -> (np.ndarray, float):
+    # the objective is linear in the portions for every durations choice, hence a single mixed-integer program:
+    # y[k, i] - the principal portion of track k taking DURATIONS[i], z[k, i] - binary choice of that duration.
+    # totals / first_payments: (len(rate_types), len(DURATIONS)) unit-principal costs of each track
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    n_tracks, n_durations = totals.shape
+    n = n_tracks * n_durations
+    eye = np.eye(n)
+    per_track = np.kron(np.eye(n_tracks), np.ones(n_durations))  # sums the durations of every track
+    rate_type_rows = [np.kron(np.array([t == a for t in rate_types], dtype='float64'), np.ones(n_durations))
+                      for a in portions_bounds.keys()]
+    constraints = [LinearConstraint(np.hstack([eye, -eye]), -np.inf, 0),  # y <= z
+                   LinearConstraint(np.hstack([np.zeros((n_tracks, n)), per_track]), 0, 1),  # single duration per track
+                   LinearConstraint(np.hstack([np.ones(n), np.zeros(n)]), 1, 1),  # sum(portions) == 1
+                   LinearConstraint(np.hstack([first_payments.ravel(), np.zeros(n)]), -np.inf, max_first_payment_fraction),
+                   LinearConstraint(np.hstack([np.array(rate_type_rows), np.zeros((len(rate_type_rows), n))]),
+                                    [b[0] for b in portions_bounds.values()],
+                                    [b[1] for b in portions_bounds.values()])]
+    with timed('milp'):
+        result = milp(np.concatenate([totals.ravel(), np.zeros(n)]),
+                      constraints=constraints,
+                      integrality=np.concatenate([np.zeros(n), np.ones(n)]),
+                      bounds=Bounds(0, 1),
+                      options={'mip_rel_gap': 0})  # the exact optimum, not highs' default 1e-4 relative gap
+    count('milp_solves')
+    if result.x is None:  # no feasible composition under the first payment cap
+        return None, np.inf
+    portions = result.x[:n].reshape(n_tracks, n_durations)
+    portions[portions < 1e-9] = 0.
+    return portions, result.fun
+
+
+def lp_principal_portions(monthly_rates_dictionary: dict,
+                          max_first_payment_fraction: float,
+                          equal_amortization=False,
+                          set_prime_portion=None,
+                          payments_bank: PaymentsBank = None) -> (dict, float):
+    # exact & deterministic counterpart of the differential evolution over the principal portions
+    if payments_bank is None:
+        payments_bank = get_payments_bank(monthly_rates_dictionary, equal_amortization=equal_amortization)
+    rate_types = ['fixed', 'madad', 'prime']
+    portions, net_payments = milp_composition(np.array([payments_bank.totals[a] for a in rate_types]),
+                                              np.array([payments_bank.first_payments[a] for a in rate_types],
+                                                       dtype='float64'),
+                                              rate_types,
+                                              principal_portions_bounds(set_prime_portion),
+                                              max_first_payment_fraction)
+    if portions is None:
+        return {}, net_payments
+    principal_portions = dict(zip(rate_types, portions.sum(axis=1)))
+    durations = dict(zip(rate_types, [DURATIONS[i] for i in portions.argmax(axis=1)]))
+    return materialize_composition(payments_bank, principal_portions, durations), net_payments
+
+
+def de_workers_kwargs(de_workers=1) -> dict:
+    # differential_evolution's own parallelism (a single large job), the population is then updated per generation
+    if de_workers == 1:
+        return {}
+    return {'workers': de_workers, 'updating': 'deferred'}
+
+
+class PortionsTargetFunction:
+    # a module level (picklable) objective, for differential_evolution's workers
+    def __init__(self, payments_bank: PaymentsBank, max_first_payment_fraction: float, set_prime_portion=None):
+        self.payments_bank = payments_bank
+        self.max_first_payment_fraction = max_first_payment_fraction
+        self.set_prime_portion = set_prime_portion
+
+    def __call__(self, portions_array): # (fixed_portion, madad_portion[, prime_portion])
+        count('objective_calls')
+        try:
+            _, net_payments = get_optimized_composition(None,
+                                                        {'fixed': portions_array[0],
+                                                         'madad': portions_array[1],
+                                                         'prime': (portions_array[2] if self.set_prime_portion is None
+                                                                   else self.set_prime_portion)},
+                                                        self.max_first_payment_fraction,
+                                                        payments_bank=self.payments_bank)
+        except ValueError:
+            return np.pi # >3 x 1 (principal)
+        return net_payments
+
+
 def get_optimized_principal_portions(monthly_rates_dictionary: dict,
                                      max_first_payment_fraction: float,
                                      equal_amortization=False,
-                                     set_prime_portion=None) -> (dict, float):
+                                     set_prime_portion=None,
+                                     engine='de',
+                                     de_workers=1,
+                                     x0=None) -> (dict, float):
+    # x0: an initial guess of the differential evolution's portions (warm starting from a former optimum)
+    payments_bank = get_payments_bank(monthly_rates_dictionary, equal_amortization=equal_amortization)
+    if engine == 'lp':
+        return lp_principal_portions(monthly_rates_dictionary,
+                                     max_first_payment_fraction,
+                                     equal_amortization=equal_amortization,
+                                     set_prime_portion=set_prime_portion,
+                                     payments_bank=payments_bank)
+    if engine != 'de':
+        raise ValueError(f">>> engine must be one of ['de', 'lp'], got {engine}")
+    from scipy.optimize import differential_evolution, NonlinearConstraint
+    target_function = tracked_objective(PortionsTargetFunction(payments_bank, max_first_payment_fraction,
+                                                               set_prime_portion))
     if set_prime_portion is None:
-        def target_function(portions_array): # (fixed_portion, madad_portion, prime_portion)
-            try:
-                _, net_payments = get_optimized_composition(monthly_rates_dictionary,
-                                                            {'fixed': portions_array[0],
-                                                             'madad': portions_array[1],
-                                                             'prime': portions_array[2]},
-                                                            max_first_payment_fraction,
-                                                            equal_amortization=equal_amortization)
-            except ValueError:
-                return np.pi # >3 x 1 (principal)
-            return net_payments
-
         bounds = [(MIN_FIXED_PORTION, 1),
                   (MIN_UNFIXED_PORTON, MAX_UNFIXED_PORTON),
                   (MIN_UNFIXED_PORTON, MAX_UNFIXED_PORTON)]
         constraints = (NonlinearConstraint(lambda x: x.sum(), 1, 1))
-        result = differential_evolution(target_function, bounds, constraints=constraints, disp=False,seed=SEED)
+        with timed('de'):
+            result = differential_evolution(target_function, bounds, constraints=constraints, disp=False, seed=SEED,
+                                            x0=x0, callback=de_callback(target_function), **de_workers_kwargs(de_workers))
         optimal_principal_portions = {'fixed': result.x[0], 'madad': result.x[1], 'prime': result.x[2]}
     else:
-        def target_function(portions_array):  # (fixed_portion, madad_portion)
-            try:
-                _, net_payments = get_optimized_composition(monthly_rates_dictionary,
-                                                            {'fixed': portions_array[0],
-                                                             'madad': portions_array[1],
-                                                             'prime': set_prime_portion},
-                                                            max_first_payment_fraction,
-                                                            equal_amortization=equal_amortization)
-            except ValueError:
-                return np.pi # >3 x 1 (principal)
-            return net_payments
-
         bounds = [(MIN_FIXED_PORTION, 1),
                   (MIN_UNFIXED_PORTON, MAX_UNFIXED_PORTON - set_prime_portion)]
         constraints = (NonlinearConstraint(lambda x: x.sum(), 1 - set_prime_portion, 1 - set_prime_portion))
-        result = differential_evolution(target_function, bounds, constraints=constraints, disp=False, seed=SEED)
+        with timed('de'):
+            result = differential_evolution(target_function, bounds, constraints=constraints, disp=False, seed=SEED,
+                                            x0=x0, callback=de_callback(target_function), **de_workers_kwargs(de_workers))
         optimal_principal_portions = {'fixed': result.x[0], 'madad': result.x[1], 'prime': set_prime_portion}
 
     return get_optimized_composition(monthly_rates_dictionary,
                                      optimal_principal_portions,
                                      max_first_payment_fraction,
-                                     equal_amortization=equal_amortization)
+                                     equal_amortization=equal_amortization,
+                                     payments_bank=payments_bank)
+
+
+JOINT_TRACKS = [(amortization, rate) for amortization in ['equal', 'spitzer'] for rate in ['fixed', 'madad', 'prime']]
+
+
+def amortization_tracks(equal_amortization=None) -> list:
+    # the (amortization, rate type) tracks of a single amortization or of a joint optimization
+    if equal_amortization is None:
+        return JOINT_TRACKS
+    amortization = 'equal' if equal_amortization else 'spitzer'
+    return [(amortization, rate) for rate in ['fixed', 'madad', 'prime']]
+
+
+class JointTargetFunction:
+    # (madad_portion[, prime_portion], equal share of the fixed, madad & prime portions), the fixed one completing to 1
+    def __init__(self, totals: np.ndarray, first_payments: np.ndarray, max_first_payment_fraction: float,
+                 set_prime_portion=None):
+        self.totals = totals
+        self.first_payments = first_payments
+        self.max_first_payment_fraction = max_first_payment_fraction
+        self.set_prime_portion = set_prime_portion
+
+    def joint_portions(self, x) -> np.ndarray: # portion of every JOINT_TRACKS
+        unfixed_portions = x[:-3] if self.set_prime_portion is None else np.append(x[:-3], self.set_prime_portion)
+        rate_portions = np.concatenate([[1 - unfixed_portions.sum()], unfixed_portions])
+        return np.concatenate([rate_portions * x[-3:], rate_portions * (1 - x[-3:])])
+
+    def __call__(self, x):
+        count('objective_calls')
+        portions = self.joint_portions(x)[:, None]
+        indices, net_payments = pareto_composition_search(self.totals * portions,
+                                                          self.first_payments * portions,
+                                                          self.max_first_payment_fraction)
+        if indices is None:
+            return np.pi # >3 x 1 (principal)
+        return net_payments
+
+
+def joint_principal_portions(monthly_rates_dictionary: dict,
+                             max_first_payment_fraction: float,
+                             set_prime_portion=None,
+                             engine='de',
+                             de_workers=1,
+                             x0=None) -> (dict, float):
+    # a single optimization over all the (amortization, rate type) tracks, sharing the first payment cap
+    payments_banks = {'equal': get_payments_bank(monthly_rates_dictionary, equal_amortization=True),
+                      'spitzer': get_payments_bank(monthly_rates_dictionary, equal_amortization=False)}
+    totals = np.array([payments_banks[a].totals[r] for a, r in JOINT_TRACKS])
+    first_payments = np.array([payments_banks[a].first_payments[r] for a, r in JOINT_TRACKS], dtype='float64')
+    portions_bounds = principal_portions_bounds(set_prime_portion)
+
+    if engine == 'lp':
+        portions, net_payments = milp_composition(totals,
+                                                  first_payments,
+                                                  [r for _, r in JOINT_TRACKS],
+                                                  portions_bounds,
+                                                  max_first_payment_fraction)
+        if portions is None:
+            return {}, net_payments
+        track_portions, track_durations = portions.sum(axis=1), portions.argmax(axis=1)
+    elif engine == 'de':
+        from scipy.optimize import differential_evolution, NonlinearConstraint
+        target_function = JointTargetFunction(totals, first_payments, max_first_payment_fraction, set_prime_portion)
+        if set_prime_portion is None:
+            bounds = [portions_bounds['madad'], portions_bounds['prime']] + [(0, 1)] * 3
+            constraints = (NonlinearConstraint(lambda x: 1 - x[0] - x[1], *portions_bounds['fixed']))
+        else:
+            bounds = [portions_bounds['madad']] + [(0, 1)] * 3
+            constraints = ()
+        # the objective is piecewise linear, a gradient based polishing has nothing to add
+        with timed('de'):
+            objective = tracked_objective(target_function)
+            result = differential_evolution(objective, bounds, constraints=constraints, tol=1e-3, polish=False,
+                                            disp=False, seed=SEED, x0=x0, callback=de_callback(objective),
+                                            **de_workers_kwargs(de_workers))
+        track_portions = target_function.joint_portions(result.x)
+        track_durations, net_payments = pareto_composition_search(totals * track_portions[:, None],
+                                                                  first_payments * track_portions[:, None],
+                                                                  max_first_payment_fraction)
+        if track_durations is None:
+            return {}, net_payments
+    else:
+        raise ValueError(f">>> engine must be one of ['de', 'lp'], got {engine}")
+
+    optimal_result = {}
+    for amortization in ['equal', 'spitzer']:
+        tracks = [k for k, (a, _) in enumerate(JOINT_TRACKS) if a == amortization]
+        optimal_result[f'{amortization}_optimal_result'] = materialize_composition(
+            payments_banks[amortization],
+            {JOINT_TRACKS[k][1]: track_portions[k] for k in tracks},
+            {JOINT_TRACKS[k][1]: DURATIONS[track_durations[k]] for k in tracks})
+    return optimal_result, net_payments
 
 
 def get_optimized_principal_portions_with_amortization_defined(monthly_rates_dictionary: dict,
                                                                max_first_payment_fraction: float,
                                                                equal_amortization=None,
-                                                               set_prime_portion=None) -> (dict, float):
+                                                               set_prime_portion=None,
+                                                               engine='de',
+                                                               de_workers=1,
+                                                               x0=None) -> (dict, float):
     if equal_amortization is not None:
         return get_optimized_principal_portions(monthly_rates_dictionary,
                                                 max_first_payment_fraction,
                                                 equal_amortization=equal_amortization,
-                                                set_prime_portion=set_prime_portion)
-
-    equal_optimal_result, equal_net_payments = get_optimized_principal_portions(monthly_rates_dictionary,
-                                                                                max_first_payment_fraction,
-                                                                               equal_amortization=True,
-                                                                               set_prime_portion=set_prime_portion)
-    spitzer_optimal_result, spitzer_net_payments = get_optimized_principal_portions(monthly_rates_dictionary,
-                                                                                    max_first_payment_fraction,
-                                                                                   equal_amortization=False,
-                                                                                   set_prime_portion=set_prime_portion)
-
-    def target_function(equal_portion):
-        return equal_portion * equal_net_payments + (1 - equal_portion) * spitzer_net_payments
-
-    bounds = [(0, 1)]
-    result = differential_evolution(target_function, bounds, disp=False, seed=SEED)
-    equal_portion = result.x
-    if equal_portion >= 0.97:
-        _equal_optimal_result = {}
-        for k in equal_optimal_result.keys():
-            _equal_optimal_result['equal_' + k] = equal_optimal_result[k]
-        return _equal_optimal_result, equal_net_payments
-    elif equal_portion <= 0.03:
-        _spitzer_optimal_result = {}
-        for k in equal_optimal_result.keys():
-            _spitzer_optimal_result['spitzer_' + k] = spitzer_optimal_result[k]
-        return _spitzer_optimal_result, spitzer_net_payments
-
-    for k in equal_optimal_result.keys():
-        for d in equal_optimal_result[k].keys():
-            equal_optimal_result[k][d]['pmt'] = equal_optimal_result[k][d]['pmt'] * equal_portion
-            equal_optimal_result[k][d]['ipmt'] = equal_optimal_result[k][d]['ipmt'] * equal_portion
-            equal_optimal_result[k][d]['ppmt'] = equal_optimal_result[k][d]['ppmt'] * equal_portion
-
-    spitzer_portion = 1 - equal_portion
-    for k in spitzer_optimal_result.keys():
-        for d in spitzer_optimal_result[k].keys():
-            spitzer_optimal_result[k][d]['pmt'] = spitzer_optimal_result[k][d]['pmt'] * spitzer_portion
-            spitzer_optimal_result[k][d]['ipmt'] = spitzer_optimal_result[k][d]['ipmt'] * spitzer_portion
-            spitzer_optimal_result[k][d]['ppmt'] = spitzer_optimal_result[k][d]['ppmt'] * spitzer_portion
-
-    net_payments = equal_net_payments * equal_portion + spitzer_net_payments * spitzer_portion
-
-    optimal_result = {'equal_optimal_result': equal_optimal_result, 'spitzer_optimal_result': spitzer_optimal_result}
-    return optimal_result, net_payments
+                                                set_prime_portion=set_prime_portion,
+                                                engine=engine,
+                                                de_workers=de_workers,
+                                                x0=x0)
+
+    return joint_principal_portions(monthly_rates_dictionary,
+                                    max_first_payment_fraction,
+                                    set_prime_portion=set_prime_portion,
+                                    engine=engine,
+                                    de_workers=de_workers,
+                                    x0=x0)
+
+
+def iterate_tracks(optimal_result: dict, equal_amortization=None):
+    # (amortization, rate type, duration, schedule) of every track of a single amortization or of a joint result
+    if equal_amortization is not None:
+        optimal_result = {f"{'equal' if equal_amortization else 'spitzer'}_optimal_result": optimal_result}
+    for k1, tracks in optimal_result.items():
+        for k2, track in tracks.items():
+            for duration, schedule in track.items():
+                yield k1.split('_')[0], k2.split('_')[0], duration, schedule
+
 
 def optimize(max_first_payment_fraction: float,
              funding_rate: float,
              is_married_couple=False,
              equal_amortization=None,
-             set_prime_portion=None):
+             set_prime_portion=None,
+             engine='de',
+             de_workers=1,
+             instrument=False):
+    # instrument=True returns (optimal_result, net_payments, instrumentation.OptimizationStats)
+    if instrument:
+        with collect_stats() as stats:
+            with timed('optimize'):
+                optimal_result, net_payments = optimize(max_first_payment_fraction,
+                                                        funding_rate,
+                                                        is_married_couple=is_married_couple,
+                                                        equal_amortization=equal_amortization,
+                                                        set_prime_portion=set_prime_portion,
+                                                        engine=engine,
+                                                        de_workers=de_workers)
+        return optimal_result, net_payments, stats
+    if engine == 'table':  # precomputed by lookup_table.build_lookup_table
+        from lookup_table import table_optimize
+        try:
+            return table_optimize(max_first_payment_fraction,
+                                  funding_rate,
+                                  is_married_couple=is_married_couple,
+                                  equal_amortization=equal_amortization,
+                                  set_prime_portion=set_prime_portion)
+        except FileNotFoundError:  # the table is built, not shipped: the exact lp answers without it
+            count('table_fallbacks')
+            engine = 'lp'
+    validate_optimization_inputs(max_first_payment_fraction, funding_rate)
+    with timed('rates'):
+        hits = rates_cache_info().hits
+        monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
+        count('rates_cache_hits' if rates_cache_info().hits > hits else 'rates_cache_misses')
+    return get_optimized_principal_portions_with_amortization_defined(monthly_rates,
+                                                                      max_first_payment_fraction,
+                                                                      equal_amortization=equal_amortization,
+                                                                      set_prime_portion=set_prime_portion,
+                                                                      engine=engine,
+                                                                      de_workers=de_workers)
+
+
+def validate_optimization_inputs(max_first_payment_fraction: float, funding_rate: float):
     if max_first_payment_fraction > 1 / MIN_DURATION:
         raise ValueError(f'Max first payment fraction must be <= 1 / {MIN_DURATION} '
                          f'>>> max_first_payment_fraction == {max_first_payment_fraction}.')
@@ -194,11 +586,6 @@ def optimize(max_first_payment_fraction: float,
     if funding_rate <= 0:
         raise ValueError(f'Max funding rate must be > {0} '
                          f'>>> funding_rate == {funding_rate}.')
-    monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
-    return get_optimized_principal_portions_with_amortization_defined(monthly_rates,
-                                                                      max_first_payment_fraction,
-                                                                      equal_amortization=equal_amortization,
-                                                                      set_prime_portion=set_prime_portion)
 
 
 if __name__ == '__main__':
@@ -244,6 +631,17 @@ if __name__ == '__main__':
                                             set_prime_portion=set_prime_portion)
     pp(optimal_result)
 
+    # cross-checking the exact (lp) engine against the differential evolution one:
+    lp_optimal_result, lp_net_payments = optimize(max_first_payment_fraction,
+                                                  funding_rate,
+                                                  is_married_couple=is_married_couple,
+                                                  equal_amortization=equal_amortization,
+                                                  set_prime_portion=set_prime_portion,
+                                                  engine='lp')
+    print(f'de: {net_payments}, lp: {lp_net_payments}')
+    for k in lp_optimal_result.keys():
+        print(k, list(optimal_result.get(k, {}).keys()), list(lp_optimal_result[k].keys()))
+
     # multiplying with finance:
     optimal_result_finance = {}
     for k1, v in optimal_result.items():
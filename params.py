@@ -12,7 +12,17 @@ dt_y = 5
 MAX_DURATION = 30 * dt_m
 MIN_DURATION = dt_y * dt_m
 BANK_BASE = {'spitzer': {'fixed': {}, 'madad': {}, 'prime': {}}, 'equal': {'fixed': {}, 'madad': {}, 'prime': {}}}
-DURATIONS = list(range(MIN_DURATION, MAX_DURATION + MIN_DURATION, MIN_DURATION))  # duration in step, by years strides
+DURATION_STEP = MIN_DURATION  # months, e.g. dt_m for every year or 1 for every month
+DURATIONS = list(range(MIN_DURATION, MAX_DURATION + 1, DURATION_STEP))  # any sorted durations (months) will do
+VECTORIZED_COMPOSITION_MAX_SIZE = 4096  # len(DURATIONS) ** 3 beyond which the compositions are searched by pareto fronts
+PARETO_FOLD_MAX_SIZE = 2 ** 14  # candidates of an exact pareto fold, beyond which it is bounded to breakpoints
+PARETO_FOLD_GRID = 256  # first payment breakpoints of a bounded pareto fold
+
+# numeric params:
+COMPUTE_DTYPE = 'float64'
+BANK_STORAGE_DTYPE = None  # e.g. 'float32' for large batch banks, None for COMPUTE_DTYPE
+AMORTIZATION_SCHEDULES = ['recursive', 'flat']
+AMORTIZATION_SCHEDULE = 'recursive'  # 'flat': the former average payment / principal approximation
 
 # financial constraint params:
 MAX_UNFIXED_PORTON = 0.667
@@ -31,4 +41,50 @@ STEADY_RAMP_MONTHS_DURATION = 84
 LONG_RANGE_CENTERLINE = 0.03
 BANKS_MARGINE = 0.015
 PRIME_ADDED_YEARLY_RATE = -0.0064
+INDEX_MADAD_PRINCIPAL = False  # True: the madad track pays a real rate on a principal indexed by the madad (CPI) path
+
+# rate provider params:
+BOI_INTEREST_URL = 'https://Boi.org.il/PublicApi/GetInterest'
+RATE_PROVIDER_TIMEOUT = 3  # seconds
+RATE_PROVIDER_TTL = 12 * 60 * 60  # seconds
+
+
+# scenario params:
+SCENARIO_COUNT = 10000
+SCENARIO_CHUNK_SIZE = 2000
+SCENARIO_MEAN_REVERSION = 0.5  # yearly
+MADAD_YEARLY_VOLATILITY = 0.01
+PRIME_YEARLY_VOLATILITY = 0.012
+MADAD_PRIME_CORRELATION = 0.6
+SCENARIO_RATE_FLOOR = 0.
+SCENARIO_PERCENTILES = (50, 95, 99)
+SCENARIO_FIRST_PAYMENT_PERCENTILE = 95
+
+# frontier params:
+FRONTIER_POINTS = 100  # max_first_payment_fraction grid over 1 / MAX_DURATION .. 1 / MIN_DURATION
+FRONTIER_CHUNK_SIZE = 10  # caps per pass over the segments
+FRONTIER_MAX_SIZE = 2 ** 20  # points & segments beyond which the frontier is a milp per cap
+
+# lookup table params:
+LOOKUP_TABLE_PATH = 'mortgager_table.npz'
+TABLE_FUNDING_RATES = 16  # grid points over 0 .. MAX_FUNDING_RATE_FOR_FIRST_APPARTMENT
+TABLE_FIRST_PAYMENT_POINTS = 60  # grid points over 1 / MAX_DURATION .. 1 / MIN_DURATION
+TABLE_PRIME_PORTIONS = (None, 1 / 3, 2 / 3)
+TABLE_VALIDATION_SAMPLES = 200
+
+# caching params:
+PAYMENTS_BANK_CACHE_SIZE = 32
+RATES_CACHE_SIZE = 256
+FUNDING_RATE_BUCKET = None  # e.g. 0.005 for sharing the rates of close funding rates, None for exact rates
+RESULT_CACHE_PATH = 'mortgager_results.sqlite'
+RESULT_CACHE_MAX_BYTES = 64 * 2 ** 20
+
+# batch params:
+BATCH_CHUNK_SIZE = 64
+
+# benchmark params:
+BENCHMARK_TOLERANCE = 0.25  # slowdown ratio over the baseline reported as a regression
 
+# export params:
+PARQUET_ROW_GROUP_SIZE = 2 ** 16  # rows buffered per parquet row group
+XLSX_MAX_ROWS = 2 ** 20  # excel's rows per sheet, the rest roll over to a new sheet
@@ -0,0 +1,152 @@
+import numpy as np
+from optimizer import iterate_tracks, optimize
+
+# the rows of a plan's schedules, pmt = ipmt + ppmt + indexation (the principal's madad indexation, zero unless
+# INDEX_MADAD_PRINCIPAL indexes the madad track)
+PAYMENTS = ['pmt', 'ipmt', 'ppmt', 'indexation']
+
+
+class Track:
+    # a single track of a plan: its schedule is a (4, duration) pmt, ipmt, ppmt, indexation view of the plan's buffer
+    __slots__ = ('amortization', 'rate_type', 'duration', 'portion', 'schedule')
+
+    def __init__(self, amortization: str, rate_type: str, duration: int, portion: float, schedule: np.ndarray):
+        self.amortization = amortization
+        self.rate_type = rate_type
+        self.duration = duration
+        self.portion = portion
+        self.schedule = schedule
+
+    @property
+    def name(self) -> str:
+        return f'{self.amortization}_{self.rate_type}_{self.duration}'
+
+    @property
+    def pmt(self) -> np.ndarray:
+        return self.schedule[0]
+
+    @property
+    def ipmt(self) -> np.ndarray:
+        return self.schedule[1]
+
+    @property
+    def ppmt(self) -> np.ndarray:
+        return self.schedule[2]
+
+    @property
+    def indexation(self) -> np.ndarray:
+        return self.schedule[3]
+
+    def __repr__(self):
+        return f'Track({self.amortization}, {self.rate_type}, {self.duration}, {self.portion:.6f})'
+
+
+class MortgagePlan:
+    '''
+    an optimal mix, per unit principal: its tracks (amortization, rate type, duration, portion) and their
+    schedules, all in a single contiguous (n_tracks, 4, months) buffer, zero padded beyond every track's duration
+    (months: the longest one). the tracks come in the optimizer's order, equal ones first in a joint plan.
+    an infeasible cap's plan has no tracks (and an inf net_payments).
+    '''
+    __slots__ = ('tracks', 'buffer', 'net_payments')
+
+    def __init__(self, tracks: list, buffer: np.ndarray, net_payments=np.nan):
+        # tracks: [(amortization, rate type, duration, portion)] of the buffer's rows
+        self.buffer = buffer
+        self.tracks = [Track(amortization, rate_type, int(duration), float(portion), buffer[k, :, :duration])
+                       for k, (amortization, rate_type, duration, portion) in enumerate(tracks)]
+        self.net_payments = net_payments
+
+    @classmethod
+    def from_result(cls, optimal_result: dict, net_payments=np.nan, equal_amortization=None) -> 'MortgagePlan':
+        # from optimize()'s nested results (of a single amortization, or a joint one for equal_amortization=None)
+        schedules = [(amortization, rate_type, duration, schedule)
+                     for amortization, rate_type, duration, schedule in iterate_tracks(optimal_result, equal_amortization)]
+        months = max([duration for _, _, duration, _ in schedules], default=0)
+        dtype = np.result_type(*[schedule['pmt'] for _, _, _, schedule in schedules]) if schedules else 'float64'
+        buffer = np.zeros((len(schedules), len(PAYMENTS), months), dtype=dtype)
+        tracks = []
+        for k, (amortization, rate_type, duration, schedule) in enumerate(schedules):
+            for p, payments in enumerate(PAYMENTS):
+                if payments in schedule:  # a bank of unindexed rates has no indexation: zeros
+                    buffer[k, p, :duration] = schedule[payments]
+            tracks.append((amortization, rate_type, duration, schedule['ppmt'].astype('float64').sum()))
+        return cls(tracks, buffer, net_payments)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __repr__(self):
+        return f'MortgagePlan({self.tracks}, net_payments={self.net_payments})'
+
+    @property
+    def months(self) -> int:
+        return self.buffer.shape[-1]
+
+    def total(self) -> np.ndarray:
+        # (4, months) pmt, ipmt, ppmt, indexation of all the tracks, summed in float64
+        return self.buffer.sum(axis=0, dtype='float64')
+
+    def first_payment(self) -> float:
+        return float(self.buffer[:, 0, 0].astype('float64').sum()) if len(self) else 0.
+
+    def portions(self) -> dict:
+        return {(track.amortization, track.rate_type): track.portion for track in self.tracks}
+
+    def durations(self) -> dict:
+        return {(track.amortization, track.rate_type): track.duration for track in self.tracks}
+
+    def payments(self, principal=None) -> dict:
+        # {track name: {'pmt', 'ipmt', 'ppmt', 'indexation'}} and their 'total', as htmling's renderers and export
+        # take them: per unit principal, or in (ceiled int32) shekels of a principal
+        if principal is None:
+            schedules, total = self.buffer, self.total()
+        else:
+            schedules = np.ceil(self.buffer * principal).astype('int32')
+            total = np.ceil(self.total() * principal).astype('int32')
+        payments = {track.name: dict(zip(PAYMENTS, schedules[k, :, :track.duration]))
+                    for k, track in enumerate(self.tracks)}
+        payments['total'] = dict(zip(PAYMENTS, total))
+        return payments
+
+    def to_dict(self) -> dict:
+        # plain json values (the worker's answer), from_dict's input
+        return {'tracks': [[t.amortization, t.rate_type, t.duration, t.portion] for t in self.tracks],
+                'dtype': self.buffer.dtype.str,
+                'months': self.months,
+                'buffer': self.buffer.tolist(),
+                'net_payments': float(self.net_payments)}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'MortgagePlan':
+        # an infeasible plan's buffer is empty: its shape comes from months, not from the data
+        buffer = np.array(d['buffer'], dtype=d['dtype']).reshape(len(d['tracks']), len(PAYMENTS), d['months'])
+        return cls([tuple(track) for track in d['tracks']], buffer, d['net_payments'])
+
+
+def optimize_plan(max_first_payment_fraction: float,
+                  funding_rate: float,
+                  is_married_couple=False,
+                  equal_amortization=None,
+                  set_prime_portion=None,
+                  engine='de',
+                  de_workers=1) -> MortgagePlan:
+    # optimize(), as a MortgagePlan
+    optimal_result, net_payments = optimize(max_first_payment_fraction,
+                                            funding_rate,
+                                            is_married_couple=is_married_couple,
+                                            equal_amortization=equal_amortization,
+                                            set_prime_portion=set_prime_portion,
+                                            engine=engine,
+                                            de_workers=de_workers)
+    return MortgagePlan.from_result(optimal_result, net_payments, equal_amortization)
+
+
+if __name__ == '__main__':
+    principal, asset_cost = 1200000, 2150000
+    plan = optimize_plan(6718 / principal, principal / asset_cost, equal_amortization=None, engine='lp')
+    print(plan)
+    print(f'first payment: {plan.first_payment() * principal:.0f}, buffer: {plan.buffer.shape} {plan.buffer.dtype}')
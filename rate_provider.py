@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import urllib.request
+from time import monotonic
+from params import *
+
+RATES_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rates_snapshot.json')
+
+
+def parse_boi_interest(response: dict) -> float:
+    # https://Boi.org.il/PublicApi/GetInterest answers the yearly interest in percents
+    return float(response['currentInterest']) / 100
+
+
+class RateProvider:
+    # the bank of israel interest rate, the prime curve's initial value
+    def get_interest_rate(self) -> float:
+        raise NotImplementedError
+
+    def refresh(self) -> bool:
+        # True whenever the rate was updated
+        return False
+
+    async def refresh_async(self) -> bool:
+        return False
+
+
+class OfflineRateProvider(RateProvider):
+    # the bundled snapshot, read on first use
+    def __init__(self, path=RATES_SNAPSHOT_PATH):
+        self.path = path
+        self._interest_rate = None
+
+    def get_interest_rate(self) -> float:
+        if self._interest_rate is None:
+            with open(self.path, encoding='utf-8') as f:
+                self._interest_rate = parse_boi_interest(json.load(f))
+        return self._interest_rate
+
+
+class StaticRateProvider(RateProvider):
+    def __init__(self, interest_rate: float):
+        self.interest_rate = interest_rate
+
+    def get_interest_rate(self) -> float:
+        return self.interest_rate
+
+
+class BoiRateProvider(RateProvider):
+    '''
+    bank of israel's public api. get_interest_rate never touches the network: it answers the last fetched
+    rate for ttl seconds and the fallback provider's otherwise. fetching is explicit (refresh / refresh_async)
+    and bounded by timeout seconds.
+    '''
+    def __init__(self, url=BOI_INTEREST_URL, timeout=RATE_PROVIDER_TIMEOUT, ttl=RATE_PROVIDER_TTL, fallback=None):
+        self.url = url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.fallback = fallback if fallback is not None else OfflineRateProvider()
+        self._interest_rate = None
+        self._fetched_at = None
+
+    def is_fresh(self) -> bool:
+        return self._fetched_at is not None and monotonic() - self._fetched_at < self.ttl
+
+    def get_interest_rate(self) -> float:
+        if self.is_fresh():
+            return self._interest_rate
+        return self.fallback.get_interest_rate()
+
+    def _update(self, interest_rate: float) -> bool:
+        updated = interest_rate != self.get_interest_rate()
+        self._interest_rate, self._fetched_at = interest_rate, monotonic()
+        return updated
+
+    def fetch(self) -> float:
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            return parse_boi_interest(json.load(response))
+
+    async def fetch_async(self) -> float:
+        try:
+            from pyodide.http import pyfetch  # the browser has no sockets
+            from pyodide.ffi import JsException
+        except ImportError:
+            return await asyncio.get_running_loop().run_in_executor(None, self.fetch)
+        try:
+            response = await pyfetch(self.url)
+            return parse_boi_interest(await response.json())
+        except JsException as e:  # the browser's network (or cors) failure
+            raise OSError(str(e)) from e
+
+    def refresh(self) -> bool:
+        try:
+            return self._update(self.fetch())
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    async def refresh_async(self) -> bool:
+        try:
+            return self._update(await asyncio.wait_for(self.fetch_async(), self.timeout))
+        except (OSError, ValueError, KeyError, TypeError, asyncio.TimeoutError):
+            return False
+
+
+def save_snapshot(interest_rate: float, path=RATES_SNAPSHOT_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'currentInterest': round(100 * interest_rate, 4), 'source': BOI_INTEREST_URL}, f, indent=4)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    # updating the bundled snapshot
+    provider = BoiRateProvider()
+    if provider.refresh():
+        save_snapshot(provider.get_interest_rate())
+    print(f'interest rate: {provider.get_interest_rate()}, fetched: {provider.is_fresh()}')
@@ -0,0 +1,159 @@
+import hashlib
+import pickle
+import sqlite3
+from time import time
+import numpy as np
+import params
+import financials
+from instrumentation import collect_stats, count, stop_requests, timed
+from optimizer import optimize
+from params import *
+
+RESULT_FORMAT_VERSION = 1  # of the stored (optimal_result, net_payments), bumped whenever their layout changes
+
+
+def rates_fingerprint() -> str:
+    # params.py constants, the runtime dtype policy & amortization schedule, the madad / prime curves and the
+    # stored results' format version: any change invalidates the stored results
+    h = hashlib.sha256()
+    constants = sorted((k, v) for k, v in vars(params).items() if k.isupper())
+    h.update(repr(constants).encode())
+    runtime = (sorted((k, np.dtype(v).str) for k, v in financials.DTYPE_POLICY.items()),
+               financials.AMORTIZATION_SCHEDULE,
+               RESULT_FORMAT_VERSION)
+    h.update(repr(runtime).encode())
+    for curve in [financials.monthly_changing_yearly_MADAD, financials.monthly_changing_yearly_PRIME]:
+        h.update(curve.dtype.str.encode())
+        h.update(np.ascontiguousarray(curve).tobytes())
+    return h.hexdigest()
+
+
+def normalize_inputs(max_first_payment_fraction: float,
+                     funding_rate: float,
+                     is_married_couple=False,
+                     equal_amortization=None,
+                     set_prime_portion=None,
+                     engine='de',
+                     de_workers=1) -> tuple:
+    round_float = lambda x: None if x is None else float(f'{float(x):.12g}')
+    return (round_float(max_first_payment_fraction),
+            round_float(funding_rate),
+            bool(is_married_couple),
+            None if equal_amortization is None else bool(equal_amortization),
+            round_float(set_prime_portion),
+            engine,
+            engine == 'de' and de_workers != 1)  # the workers' deferred updating evolves another population
+
+
+class ResultCache:
+    '''
+    content addressed, on disk (sqlite) cache of optimize() results, evicting the least recently used
+    results beyond max_bytes. results of other params / rate curves are dropped when first seen.
+    '''
+    def __init__(self, path=RESULT_CACHE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._fingerprint = None
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, fingerprint TEXT, '
+                                'value BLOB, size INTEGER, last_access REAL)')
+        self.connection.commit()
+
+    def fingerprint(self) -> str:
+        fingerprint = rates_fingerprint()
+        if fingerprint != self._fingerprint:
+            self.connection.execute('DELETE FROM results WHERE fingerprint != ?', (fingerprint,))
+            self.connection.commit()
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def key(self, *args, **kwargs) -> str:
+        return hashlib.sha256(repr((self.fingerprint(), normalize_inputs(*args, **kwargs))).encode()).hexdigest()
+
+    def get(self, key: str):
+        row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            count('result_cache_misses')
+            return None
+        self.hits += 1
+        count('result_cache_hits')
+        self.connection.execute('UPDATE results SET last_access = ? WHERE key = ?', (time(), key))
+        self.connection.commit()
+        return pickle.loads(row[0])
+
+    def put(self, key: str, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                (key, self._fingerprint, blob, len(blob), time()))
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        for key, size in self.connection.execute('SELECT key, size FROM results ORDER BY last_access').fetchall():
+            self.connection.execute('DELETE FROM results WHERE key = ?', (key,))
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break
+
+    def get_or_compute(self, key: str, compute):
+        # the stored result of the key, or compute()'s, stored unless a progress listener stopped its evolution
+        result = self.get(key)
+        if result is None:
+            stops = stop_requests()
+            result = compute()
+            if stop_requests() == stops:
+                self.put(key, result)
+        return result
+
+    def optimize(self,
+                 max_first_payment_fraction: float,
+                 funding_rate: float,
+                 is_married_couple=False,
+                 equal_amortization=None,
+                 set_prime_portion=None,
+                 engine='de',
+                 de_workers=1,
+                 instrument=False):
+        # same as optimizer.optimize, served from the cache whenever the same submission was already optimized.
+        # instrument=True returns the stats of the lookup as well (the cache's hits & misses are counted)
+        if instrument:
+            with collect_stats() as stats:
+                with timed('optimize'):
+                    optimal_result, net_payments = self.optimize(max_first_payment_fraction,
+                                                                 funding_rate,
+                                                                 is_married_couple=is_married_couple,
+                                                                 equal_amortization=equal_amortization,
+                                                                 set_prime_portion=set_prime_portion,
+                                                                 engine=engine,
+                                                                 de_workers=de_workers)
+            return optimal_result, net_payments, stats
+        key = self.key(max_first_payment_fraction, funding_rate, is_married_couple, equal_amortization,
+                       set_prime_portion, engine, de_workers)
+        return self.get_or_compute(key, lambda: optimize(max_first_payment_fraction,
+                                                         funding_rate,
+                                                         is_married_couple=is_married_couple,
+                                                         equal_amortization=equal_amortization,
+                                                         set_prime_portion=set_prime_portion,
+                                                         engine=engine,
+                                                         de_workers=de_workers))
+
+    def clear(self):
+        self.connection.execute('DELETE FROM results')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    cache = ResultCache(':memory:')
+    for _ in range(2):
+        tic = time()
+        optimal_result, net_payments = cache.optimize(6718 / 1200000, 1200000 / 2150000, equal_amortization=False)
+        print(f'net payments: {net_payments}, {time() - tic:.4f}s, hits: {cache.hits}, misses: {cache.misses}')
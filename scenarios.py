@@ -0,0 +1,167 @@
+from itertools import product
+import numpy as np
+from financials import *
+from optimizer import get_payments_bank, materialize_composition, principal_portions_bounds, \
+    validate_optimization_inputs
+
+
+def generate_rate_scenarios(n_scenarios=SCENARIO_COUNT,
+                            seed=SEED,
+                            mean_reversion=SCENARIO_MEAN_REVERSION,
+                            madad_volatility=MADAD_YEARLY_VOLATILITY,
+                            prime_volatility=PRIME_YEARLY_VOLATILITY,
+                            correlation=MADAD_PRIME_CORRELATION) -> dict:
+    '''
+    (n_scenarios, MAX_DURATION) yearly madad & prime paths: correlated, mean reverting (Ornstein-Uhlenbeck)
+    deviations around the deterministic get_madad / get_prime curves, floored at SCENARIO_RATE_FLOOR.
+    '''
+    rng = np.random.default_rng(seed)
+    dt = 1 / dt_m
+    rate_curves = get_rate_curves()
+    shocks = rng.standard_normal((2, n_scenarios, MAX_DURATION)) * np.sqrt(dt)
+    shocks[1] = correlation * shocks[0] + np.sqrt(1 - correlation ** 2) * shocks[1]
+    deviations = np.zeros_like(shocks)
+    for month in range(1, MAX_DURATION):
+        deviations[:, :, month] = deviations[:, :, month - 1] * (1 - mean_reversion * dt) + shocks[:, :, month]
+    deviations[0] *= madad_volatility
+    deviations[1] *= prime_volatility
+    return {'madad': np.maximum(rate_curves['madad'][:MAX_DURATION] + deviations[0], SCENARIO_RATE_FLOOR),
+            'prime': np.maximum(rate_curves['prime'][:MAX_DURATION] + deviations[1], SCENARIO_RATE_FLOOR)}
+
+
+def scenario_totals(scenarios: dict,
+                    funding_rate: float,
+                    is_married_couple=False,
+                    equal_amortization=False,
+                    chunk_size=SCENARIO_CHUNK_SIZE) -> (np.ndarray, np.ndarray):
+    # (n_scenarios, 3 [fixed, madad, prime], len(DURATIONS)) totals & first payments per unit principal
+    n_scenarios = len(scenarios['madad'])
+    totals = np.empty((n_scenarios, 3, len(DURATIONS)))
+    first_payments = np.empty_like(totals)
+    for start in range(0, n_scenarios, chunk_size):  # bounded memory
+        monthly_rates = risk_adjusted_monthly_rates(scenarios['madad'][start:start + chunk_size],
+                                                    scenarios['prime'][start:start + chunk_size],
+                                                    funding_rate,
+                                                    is_married_couple)
+        for t, rate in enumerate(['fixed_rate', 'madad_rate', 'prime_rate']):
+            # the fixed rate is the same in every scenario
+            rates = monthly_rates[rate][:1] if rate == 'fixed_rate' else monthly_rates[rate]
+            inflation = monthly_rates.get('madad_inflation') if rate == 'madad_rate' else None
+            # only the totals & first payments: no pmt / ipmt / ppmt tensors
+            totals[start:start + chunk_size, t], first_payments[start:start + chunk_size, t] = amortization_totals(
+                rates, DURATIONS, equal_amortization=equal_amortization, monthly_inflation=inflation)
+    return totals, first_payments
+
+
+def evaluate_compositions(totals: np.ndarray,
+                          first_payments: np.ndarray,
+                          portions: np.ndarray,
+                          duration_indices: np.ndarray,
+                          percentiles=SCENARIO_PERCENTILES,
+                          chunk_size=SCENARIO_CHUNK_SIZE) -> dict:
+    # portions / duration_indices: (n_candidates, 3 [fixed, madad, prime]). net_payments statistics per candidate:
+    # the mean & std in closed form (net_payments are linear in the tracks' totals, whose means & covariances are
+    # taken once), the percentiles reduced a chunk_size block of candidates at a time: (chunk_size, n_scenarios)
+    # bounded memory, a candidate's scenarios contiguous (the percentiles' partitions run along them)
+    n_candidates, n_durations = len(portions), totals.shape[-1]
+    stats = {k: np.empty(n_candidates) for k in ['mean', 'std', *[f'p{q}' for q in percentiles], 'first_payment']}
+    columns = np.arange(3) * n_durations + duration_indices  # (n_candidates, 3) into the flattened tracks' totals
+    flat_totals = totals.reshape(len(totals), -1)
+    stats['mean'][:] = (flat_totals.mean(axis=0)[columns] * portions).sum(axis=1)
+    covariance = np.cov(flat_totals, rowvar=False, bias=True)
+    variance = sum(covariance[columns[:, j], columns[:, k]] * portions[:, j] * portions[:, k]
+                   for j in range(3) for k in range(3))
+    stats['std'][:] = np.sqrt(np.maximum(variance, 0))
+    # every path starts from the deterministic curves: the first payments are usually the same in all scenarios
+    same_first_payments = bool(np.all(first_payments == first_payments[:1]))
+    if same_first_payments:
+        stats['first_payment'][:] = sum(first_payments[0, t, duration_indices[:, t]] * portions[:, t] for t in range(3))
+    if not percentiles and same_first_payments:
+        return stats
+    totals = np.ascontiguousarray(np.moveaxis(totals, 0, -1))  # (3, len(DURATIONS), n_scenarios)
+    if not same_first_payments:
+        first_payments = np.ascontiguousarray(np.moveaxis(first_payments, 0, -1))
+    for start in range(0, n_candidates, chunk_size):
+        block = slice(start, start + chunk_size)
+        block_portions, block_indices = portions[block], duration_indices[block]
+        if percentiles:
+            net_payments = totals[0, block_indices[:, 0]] * block_portions[:, :1]
+            for t in range(1, 3):
+                net_payments += totals[t, block_indices[:, t]] * block_portions[:, t:t + 1]
+            for q, v in zip(percentiles, np.percentile(net_payments, percentiles, axis=1)):
+                stats[f'p{q}'][block] = v
+        if not same_first_payments:
+            first_payment = sum(first_payments[t, block_indices[:, t]] * block_portions[:, t:t + 1] for t in range(3))
+            stats['first_payment'][block] = np.percentile(first_payment, SCENARIO_FIRST_PAYMENT_PERCENTILE, axis=1)
+    return stats
+
+
+def candidate_compositions(principal_portions=None, set_prime_portion=None, portion_step=None) -> (np.ndarray, np.ndarray):
+    # every duration triple, for the given portions or for a grid of (portion_step) portions within the bounds
+    if principal_portions is not None:
+        portions = [[principal_portions['fixed'], principal_portions['madad'], principal_portions['prime']]]
+    else:
+        bounds = principal_portions_bounds(set_prime_portion)
+        step = portion_step or 0.05
+        portions = []
+        for madad in np.arange(bounds['madad'][0], bounds['madad'][1] + 1e-9, step):
+            for prime in np.arange(bounds['prime'][0], bounds['prime'][1] + 1e-9, step):
+                if bounds['fixed'][0] <= 1 - madad - prime <= bounds['fixed'][1]:
+                    portions.append([1 - madad - prime, madad, prime])
+    duration_indices = np.array(list(product(range(len(DURATIONS)), repeat=3)))
+    portions = np.repeat(np.array(portions), len(duration_indices), axis=0)
+    duration_indices = np.tile(duration_indices, (len(portions) // len(duration_indices), 1))
+    return portions, duration_indices
+
+
+def stress_test(max_first_payment_fraction: float,
+                funding_rate: float,
+                is_married_couple=False,
+                equal_amortization=False,
+                principal_portions=None,
+                set_prime_portion=None,
+                objective='mean',
+                scenarios=None,
+                portion_step=None) -> (dict, dict):
+    '''
+    the composition minimizing the objective ('mean' or a percentile, e.g. 'p95') of net_payments over the
+    rate scenarios, among the candidates whose SCENARIO_FIRST_PAYMENT_PERCENTILE first payment is under the cap.
+    returns the (deterministic rates) schedules of that composition and its net_payments statistics.
+    '''
+    validate_optimization_inputs(max_first_payment_fraction, funding_rate)
+    if scenarios is None:
+        scenarios = generate_rate_scenarios()
+    totals, first_payments = scenario_totals(scenarios, funding_rate, is_married_couple, equal_amortization)
+    portions, duration_indices = candidate_compositions(principal_portions, set_prime_portion, portion_step)
+    objectives = ['mean', 'std', *[f'p{q}' for q in SCENARIO_PERCENTILES], 'first_payment']
+    if objective not in objectives:
+        raise ValueError(f'>>> objective must be one of {objectives}, got {objective}')
+    # the candidates are ranked on the objective's percentile alone, the best one gets them all
+    ranked_percentiles = [int(objective[1:])] if objective.startswith('p') else []
+    stats = evaluate_compositions(totals, first_payments, portions, duration_indices, ranked_percentiles)
+    score = np.where(stats['first_payment'] <= max_first_payment_fraction, stats[objective], np.inf)
+    best = np.argmin(score)
+    if np.isinf(score[best]):
+        return {}, {}
+    payments_bank = get_payments_bank(update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple),
+                                      equal_amortization=equal_amortization)
+    rate_types = ['fixed', 'madad', 'prime']
+    optimal_result = materialize_composition(payments_bank,
+                                             dict(zip(rate_types, portions[best])),
+                                             dict(zip(rate_types, [DURATIONS[i] for i in duration_indices[best]])))
+    stats = evaluate_compositions(totals, first_payments, portions[best:best + 1], duration_indices[best:best + 1])
+    return optimal_result, {k: float(v[0]) for k, v in stats.items()}
+
+
+if __name__ == '__main__':
+    from time import time
+
+    tic = time()
+    scenarios = generate_rate_scenarios()
+    print(f'{SCENARIO_COUNT} scenarios generated in {time() - tic:.3f}s')
+    tic = time()
+    optimal_result, stats = stress_test(6718 / 1200000, 1200000 / 2150000,
+                                        principal_portions={'fixed': 0.5, 'madad': 0.2, 'prime': 0.3},
+                                        objective='p95', scenarios=scenarios)
+    print(f'stress tested in {time() - tic:.3f}s: {stats}')
+    print({k: list(v.keys()) for k, v in optimal_result.items()})
@@ -0,0 +1,163 @@
+import numpy as np
+from optimizer import *
+from plan import MortgagePlan
+
+
+class OptimizerSession:
+    '''
+    incremental optimize() for repeated submissions of the same borrower, changing one input at a time.
+    keeps the rates & payments banks of the last (funding_rate, is_married_couple), their unit-principal
+    duration tables and the last optimum. every submission is solved by the session's engine alone, so that an
+    answer never depends on the submissions before it:
+    - 'lp': a single milp_composition over the kept duration tables (no payments bank to rebuild), the first
+      submission and any later change alike. a max_first_payment_fraction the last optimum is known to be
+      optimal for (it meets the cap, which is either tighter than the one it was optimized under, or looser
+      while the optimum is the unconstrained one) is served as is.
+    - 'de' / 'table': optimizer.optimize's, the last optimum served again for the same submission only.
+    cache: a result_cache.ResultCache serving (and storing) the solved submissions across sessions.
+    '''
+    def __init__(self, engine='de', de_workers=1, cache=None):
+        self.engine = engine
+        self.de_workers = de_workers
+        self.cache = cache
+        self.rates_key = None  # (funding_rate, is_married_couple, the curves' generation) of the kept rates
+        self.monthly_rates = None
+        self.payments_banks = {}
+        self.duration_tables = {}  # {equal_amortization: (totals, first_payments)} (n_tracks, len(DURATIONS))
+        self.unconstrained_net_payments = {}  # {(equal_amortization, set_prime_portion): net_payments with no cap}
+        self.last = None
+        self.stats = {'reused': 0, 'warm': 0, 'cold': 0}
+
+    def set_rates(self, funding_rate: float, is_married_couple=False):
+        # rebuilt (a refreshed or expired provider rate) or set curves rebuild the kept rates with them
+        rates_key = (float(funding_rate), bool(is_married_couple), get_rate_curves()['generation'])
+        if rates_key == self.rates_key:
+            return
+        self.monthly_rates = update_yearly_to_monthly_rates_with_risk(funding_rate, is_married_couple)
+        self.payments_banks = {'equal': get_payments_bank(self.monthly_rates, equal_amortization=True),
+                               'spitzer': get_payments_bank(self.monthly_rates, equal_amortization=False)}
+        self.duration_tables = {}
+        self.unconstrained_net_payments = {}
+        self.rates_key = rates_key
+
+    def duration_table(self, equal_amortization=None) -> (np.ndarray, np.ndarray):
+        if equal_amortization not in self.duration_tables:
+            tracks = amortization_tracks(equal_amortization)
+            self.duration_tables[equal_amortization] = (
+                np.array([self.payments_banks[a].totals[r] for a, r in tracks]),
+                np.array([self.payments_banks[a].first_payments[r] for a, r in tracks], dtype='float64'))
+        return self.duration_tables[equal_amortization]
+
+    def unconstrained(self, equal_amortization=None, set_prime_portion=None) -> float:
+        # the lowest net payments with no first payment cap, a lower bound of every capped optimum
+        key = (equal_amortization, set_prime_portion)
+        if key not in self.unconstrained_net_payments:
+            totals, first_payments = self.duration_table(equal_amortization)
+            _, net_payments = milp_composition(totals,
+                                               first_payments,
+                                               [r for _, r in amortization_tracks(equal_amortization)],
+                                               principal_portions_bounds(set_prime_portion),
+                                               np.inf)
+            self.unconstrained_net_payments[key] = net_payments
+        return self.unconstrained_net_payments[key]
+
+    def resolve(self, max_first_payment_fraction: float, equal_amortization=None, set_prime_portion=None) -> (dict, float):
+        # milp_composition over the kept duration tables, materialized from the kept payments banks
+        tracks = amortization_tracks(equal_amortization)
+        totals, first_payments = self.duration_table(equal_amortization)
+        portions, net_payments = milp_composition(totals,
+                                                  first_payments,
+                                                  [r for _, r in tracks],
+                                                  principal_portions_bounds(set_prime_portion),
+                                                  max_first_payment_fraction)
+        if portions is None:
+            return {}, net_payments
+        optimal_result = {}
+        for amortization in ['equal', 'spitzer']:
+            ks = [k for k, (a, _) in enumerate(tracks) if a == amortization]
+            if ks:
+                optimal_result[f'{amortization}_optimal_result'] = materialize_composition(
+                    self.payments_banks[amortization],
+                    {tracks[k][1]: portions[k].sum() for k in ks},
+                    {tracks[k][1]: DURATIONS[portions[k].argmax()] for k in ks})
+        if equal_amortization is not None:
+            return next(iter(optimal_result.values())), net_payments
+        return optimal_result, net_payments
+
+    def is_still_optimal(self, problem: tuple, max_first_payment_fraction: float) -> bool:
+        if self.last is None or self.last['problem'] != problem:
+            return False
+        if self.engine != 'lp':  # an inexact engine's optimum answers its own submission alone
+            return max_first_payment_fraction == self.last['max_first_payment_fraction']
+        if max_first_payment_fraction < self.last['first_payment']:
+            return False
+        if max_first_payment_fraction <= self.last['optimal_up_to']:
+            return True
+        equal_amortization, set_prime_portion = problem[1:3]
+        if self.last['net_payments'] <= self.unconstrained(equal_amortization, set_prime_portion) * (1 + 1e-9):
+            self.last['optimal_up_to'] = np.inf
+            return True
+        return False
+
+    def optimize(self,
+                 max_first_payment_fraction: float,
+                 funding_rate: float,
+                 is_married_couple=False,
+                 equal_amortization=None,
+                 set_prime_portion=None):
+        # same as optimizer.optimize, with the session's engine
+        validate_optimization_inputs(max_first_payment_fraction, funding_rate)
+        self.set_rates(funding_rate, is_married_couple)
+        problem = (self.rates_key, equal_amortization, set_prime_portion)
+        if self.is_still_optimal(problem, max_first_payment_fraction):
+            self.stats['reused'] += 1
+            return self.last['optimal_result'], self.last['net_payments']
+
+        self.stats['warm' if self.last is not None else 'cold'] += 1
+        if self.engine == 'lp':
+            solve = lambda: self.resolve(max_first_payment_fraction, equal_amortization, set_prime_portion)
+        else:
+            solve = lambda: optimize(max_first_payment_fraction,
+                                     funding_rate,
+                                     is_married_couple=is_married_couple,
+                                     equal_amortization=equal_amortization,
+                                     set_prime_portion=set_prime_portion,
+                                     engine=self.engine,
+                                     de_workers=self.de_workers)
+        if self.cache is None:
+            optimal_result, net_payments = solve()
+        else:
+            key = self.cache.key(max_first_payment_fraction, funding_rate, is_married_couple, equal_amortization,
+                                 set_prime_portion, self.engine, self.de_workers)
+            optimal_result, net_payments = self.cache.get_or_compute(key, solve)
+        if optimal_result:  # an infeasible cap keeps the last optimum
+            plan = MortgagePlan.from_result(optimal_result, net_payments, equal_amortization)
+            self.last = {'problem': problem,
+                         'optimal_result': optimal_result,
+                         'net_payments': net_payments,
+                         'first_payment': plan.first_payment(),
+                         'max_first_payment_fraction': max_first_payment_fraction,
+                         'optimal_up_to': max_first_payment_fraction}
+        return optimal_result, net_payments
+
+
+if __name__ == '__main__':
+    from time import time
+
+    session = OptimizerSession()
+    principal = 2150000 - 950000
+    # a user tweaking one field at a time
+    clicks = [{'max_monthly_payment': 6718, 'is_married_couple': False, 'set_prime_portion': None},
+              {'max_monthly_payment': 6718, 'is_married_couple': False, 'set_prime_portion': None},
+              {'max_monthly_payment': 6500, 'is_married_couple': False, 'set_prime_portion': None},
+              {'max_monthly_payment': 7000, 'is_married_couple': False, 'set_prime_portion': None},
+              {'max_monthly_payment': 7000, 'is_married_couple': False, 'set_prime_portion': 1 / 3},
+              {'max_monthly_payment': 7000, 'is_married_couple': True, 'set_prime_portion': 1 / 3}]
+    for click in clicks:
+        tic = time()
+        optimal_result, net_payments = session.optimize(click['max_monthly_payment'] / principal,
+                                                        principal / 2150000,
+                                                        is_married_couple=click['is_married_couple'],
+                                                        equal_amortization=False,
+                                                        set_prime_portion=click['set_prime_portion'])
+        print(f'{click}: net payments {net_payments:.6f}, {time() - tic:.4f}s, {session.stats}')
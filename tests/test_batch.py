@@ -0,0 +1,19 @@
+import numpy as np
+from batch import optimize_many
+
+
+def test_invalid_profiles_are_error_rows():
+    # an invalid funding rate is its profile's error row, whatever the rest of its group
+    profiles = {'max_first_payment_fraction': [6718 / 1200000] * 4,
+                'funding_rate': [0.55, 0.9, -0.1, 0.55]}
+    df = optimize_many(profiles, engine='lp')
+    assert list(df['error'].isna()) == [True, False, False, True]
+    assert np.isnan(df['net_payments'][1]) and np.isnan(df['net_payments'][2])
+    assert 'funding_rate == 0.9' in df['error'][1]
+    assert df['net_payments'][0] == df['net_payments'][3] < np.inf
+
+
+def test_group_of_invalid_profiles():
+    df = optimize_many({'max_first_payment_fraction': [6718 / 1200000, 1.],
+                        'funding_rate': [0.9, 0.9]}, engine='lp')
+    assert df['net_payments'].isna().all() and df['error'].notna().all()
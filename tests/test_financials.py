@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from financials import amortization_tensors, amortization_totals
+
+DURATIONS = np.array([60, 97, 240, 360])
+
+
+def reference_spitzer(monthly_rates, duration, monthly_inflation=None):
+    # month by month: the balance re-annuitized over the remaining months at the month's rate, then indexed
+    balance, index = 1., 1.
+    pmt, ipmt, ppmt, indexation = (np.zeros(duration) for _ in range(4))
+    for month in range(duration):
+        r = monthly_rates[month]
+        remaining = duration - month
+        payment = balance / remaining if r == 0 else balance * r / (1 - (1 + r) ** -remaining)
+        if monthly_inflation is not None:
+            index *= 1 + monthly_inflation[month]
+        ipmt[month] = balance * r * index
+        ppmt[month] = payment - balance * r
+        indexation[month] = ppmt[month] * (index - 1)
+        pmt[month] = payment * index
+        balance -= ppmt[month]
+    return {'pmt': pmt, 'ipmt': ipmt, 'ppmt': ppmt, 'indexation': indexation}
+
+
+@pytest.fixture
+def monthly_rates():
+    rng = np.random.default_rng(0)
+    rates = rng.uniform(0.01, 0.08, DURATIONS.max()) / 12
+    rates[:12] = 0  # a zero rate year
+    return rates
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_recursive_spitzer(monthly_rates, indexed):
+    inflation = np.full(DURATIONS.max(), 0.002) if indexed else None
+    tensors = amortization_tensors(monthly_rates, DURATIONS, schedule='recursive', monthly_inflation=inflation)
+    totals, first_payments = amortization_totals(monthly_rates, DURATIONS, schedule='recursive',
+                                                 monthly_inflation=inflation)
+    for k, duration in enumerate(DURATIONS):
+        reference = reference_spitzer(monthly_rates, duration, inflation)
+        assert ('indexation' in tensors) == indexed
+        for payments in tensors.keys() - {'mask'}:
+            np.testing.assert_allclose(tensors[payments][k, :duration], reference[payments], rtol=1e-10, atol=1e-15)
+            np.testing.assert_array_equal(tensors[payments][k, duration:], 0)
+        np.testing.assert_allclose(totals[k], reference['pmt'].sum(), rtol=1e-10)
+        np.testing.assert_allclose(first_payments[k], reference['pmt'][0], rtol=1e-10)
@@ -0,0 +1,17 @@
+import pytest
+from benchmark import AMORTIZATION_MODES, BORROWERS, batch_reports, borrower_report
+from htmling import beutify_HTML, render_HTML
+
+
+@pytest.mark.parametrize('mode', AMORTIZATION_MODES)
+@pytest.mark.parametrize('borrower', BORROWERS)
+def test_render_matches_beutify(borrower, mode):
+    report = borrower_report(*BORROWERS[borrower], mode=mode)
+    if len(report[0]) == 1:  # the total alone: an infeasible cap, which main.func reports by no_plan_HTML
+        pytest.skip('infeasible cap')
+    assert render_HTML(*report) == beutify_HTML(*report)
+
+
+def test_render_matches_beutify_batch():
+    for report in batch_reports(n=10):
+        assert render_HTML(*report) == beutify_HTML(*report)
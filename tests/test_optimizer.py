@@ -0,0 +1,8 @@
+import numpy as np
+from benchmark import crosscheck_milp
+
+
+def test_lp_not_worse_than_de():
+    # lp's exact optimum is never costlier than differential evolution's
+    for row in crosscheck_milp(n=6):
+        assert np.isinf(row['lp']) or row['lp'] <= row['de'] * (1 + 1e-9), row
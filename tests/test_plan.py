@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from financials import get_rate_curves, risk_adjusted_monthly_rates
+from optimizer import get_payments_bank, materialize_composition
+from plan import MortgagePlan, optimize_plan
+
+PRINCIPAL, ASSET_COST = 1200000, 2150000
+
+
+@pytest.mark.parametrize('equal_amortization', [False, True, None])
+def test_round_trip(equal_amortization):
+    plan = optimize_plan(6718 / PRINCIPAL, PRINCIPAL / ASSET_COST, equal_amortization=equal_amortization, engine='lp')
+    assert len(plan)
+    copy = MortgagePlan.from_dict(plan.to_dict())
+    assert [t.name for t in copy] == [t.name for t in plan]
+    assert copy.buffer.dtype == plan.buffer.dtype and np.array_equal(copy.buffer, plan.buffer)
+    assert copy.net_payments == plan.net_payments
+
+
+def test_empty_round_trip():
+    # an infeasible cap's plan
+    plan = MortgagePlan.from_result({}, np.inf)
+    copy = MortgagePlan.from_dict(plan.to_dict())
+    assert not len(copy) and copy.buffer.shape == plan.buffer.shape
+    assert copy.net_payments == np.inf
+
+
+@pytest.mark.parametrize('index_madad_principal', [False, True])
+def test_indexation(index_madad_principal):
+    # pmt = ipmt + ppmt + indexation, the indexation of the madad track alone
+    rate_curves = get_rate_curves()
+    monthly_rates = risk_adjusted_monthly_rates(rate_curves['madad'], rate_curves['prime'], PRINCIPAL / ASSET_COST,
+                                                index_madad_principal=index_madad_principal)
+    optimal_result = materialize_composition(get_payments_bank(monthly_rates, equal_amortization=False),
+                                             {'fixed': 0.5, 'madad': 0.3, 'prime': 0.2},
+                                             {'fixed': 240, 'madad': 180, 'prime': 300})
+    plan = MortgagePlan.from_result(optimal_result, 1., equal_amortization=False)
+    np.testing.assert_allclose(plan.buffer[:, 0], plan.buffer[:, 1:].sum(axis=1), atol=1e-15)
+    indexed = {track.rate_type: bool(track.indexation.any()) for track in plan}
+    assert indexed == {'fixed': False, 'madad': index_madad_principal, 'prime': False}
@@ -0,0 +1,52 @@
+import asyncio
+import json
+from financials import refresh_rate_curves_async, set_rate_provider
+from instrumentation import progress_listener
+from rate_provider import BoiRateProvider
+from session import OptimizerSession
+from plan import MortgagePlan
+from worker_protocol import BROWSER_ENGINE, plan_to_json, error_to_json, load_engine_packages
+
+from pyscript import sync
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# kept across the runs, as main.func's session was
+session = OptimizerSession(engine=BROWSER_ENGINE)
+# loaded while the user fills the form, as is bank of israel's current rate (the bundled snapshot's otherwise)
+packages_loading = asyncio.ensure_future(load_engine_packages(session.engine))
+set_rate_provider(BoiRateProvider())
+rates_refreshing = asyncio.ensure_future(refresh_rate_curves_async())
+
+
+async def run_optimize(run_id, inputs_json):
+    '''
+    main.func's optimize(), off the page's thread. every de generation is reported to the page by
+    sync.report_progress(run_id, generation, best net payments), which answers whether the run is still the
+    current one: a cancelled or superseded run stops at its next generation and answers None.
+    '''
+    await packages_loading
+    await rates_refreshing
+    if not sync.report_progress(run_id, 0, None):  # superseded while queued behind a former run
+        return None
+    cancelled = [False]
+
+    def listener(generation, convergence, best):
+        cancelled[0] = not sync.report_progress(run_id, generation, None if best is None else float(best))
+        return cancelled[0]
+
+    inputs = json.loads(inputs_json)
+    last = session.last
+    try:
+        with progress_listener(listener):
+            optimal_result, net_payments = session.optimize(**inputs)
+    except ValueError as e:
+        return error_to_json(e)
+    if cancelled[0]:
+        session.last = last  # a stopped evolution's result isn't an optimum to reuse
+        return None
+    return plan_to_json(MortgagePlan.from_result(optimal_result, net_payments, inputs['equal_amortization']))
+
+
+__export__ = ['run_optimize']
@@ -0,0 +1,40 @@
+import importlib.util
+import json
+import os
+from optimizer import SCIPY_ENGINES
+from params import LOOKUP_TABLE_PATH
+from plan import MortgagePlan
+
+# the page's engine (the worker's session, or main.func's without a worker). pyscript-lite.json ships the lookup
+# table (lookup_table.build_lookup_table's, rebuilt along any change of params.py), so that it needs numpy alone.
+# without the table it falls back to 'lp', loading scipy
+BROWSER_ENGINE = 'table'
+
+
+def plan_to_json(plan: MortgagePlan) -> str:
+    # the worker's answer to main.func. inf (an infeasible cap) is kept by json's Infinity
+    return json.dumps(plan.to_dict())
+
+
+def error_to_json(error: Exception) -> str:
+    return json.dumps({'error': str(error)})
+
+
+def plan_from_json(text: str) -> MortgagePlan:
+    # raises the worker's ValueError (e.g. validate_optimization_inputs) on the main thread
+    result = json.loads(text)
+    if 'error' in result:
+        raise ValueError(result['error'])
+    return MortgagePlan.from_dict(result)
+
+
+async def load_engine_packages(engine=BROWSER_ENGINE):
+    # pyscript-lite.json preloads numpy alone, the scipy engines load scipy (in the background, once) on demand.
+    # 'table' needs it for its 'lp' fallback only, when the bundle lacks the table
+    if engine == 'table' and not os.path.exists(LOOKUP_TABLE_PATH):
+        engine = 'lp'
+    if engine not in SCIPY_ENGINES:
+        return
+    if importlib.util.find_spec('scipy') is None:  # probed, not imported: scipy is imported by its first solve
+        import pyodide_js
+        await pyodide_js.loadPackage('scipy')